@@ -1,29 +1,20 @@
 import sqlite3
-import os
 
-# Getting the working directory of the script
-working_dir = os.path.dirname(os.path.abspath(__file__))
+from data_transfer import column_names, iter_chunks
 
-# Connect to the SQLite database
+# Stream the users table a chunk at a time instead of loading it all with
+# fetchall(). Password hashes are left out; use data_transfer.py to export to a file.
 try:
-    conn = sqlite3.connect(f"{working_dir}/main_app.db")
-    cursor = conn.cursor()
-    print("Connected to the database successfully.")
-    
-    # Query to select all data from the patient_data table
-    cursor.execute("SELECT * FROM users")
-    rows = cursor.fetchall()
-
-    if rows:
-        print("Data from users table:")
+    print("Data from users table:")
+    print(tuple(column_names('users')))
+    found = False
+    for rows in iter_chunks('users', chunksize=500):
         for row in rows:
             print(row)
-    else:
-        print("No data found in the patient_data table.")
+        found = True
+
+    if not found:
+        print("No data found in the users table.")
 
 except sqlite3.Error as e:
     print(f"An error occurred: {e}")
-finally:
-    if conn:
-        conn.close()
-        print("Connection closed.")
\ No newline at end of file
@@ -0,0 +1,212 @@
+"""Password hashing, login verification, rate limiting and session tokens.
+
+Passwords are stored as
+
+    scrypt$<n>$<r>$<p>$<salt>$<hash>
+
+with a random salt per user. Accounts registered before this module still
+hold an unsalted sha256 hex digest. They keep working, and their next
+successful login rehashes the password with scrypt in the background.
+
+scrypt is deliberately expensive: about 16 MiB and tens of milliseconds per
+call. Hashing and verification therefore run in a small shared thread pool.
+hashlib releases the GIL while it works, and the pool caps how many KDF calls
+run at once, however many sessions try to log in together.
+
+After a successful login the session keeps a signed, short-lived token.
+Reruns check the token instead of verifying the password again. Each failed
+attempt counts against a per-account limit.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from db import CLINIC_ID, DEFAULT_CLINIC, USERS_DB, connection, get_pool, write
+
+# scrypt cost parameters (the same as Django's scrypt hasher)
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+
+# Upper bound on concurrent KDF calls (each holds ~16 MiB while it runs)
+KDF_WORKERS = min(8, os.cpu_count() or 1)
+_kdf_pool = ThreadPoolExecutor(max_workers=KDF_WORKERS, thread_name_prefix='kdf')
+
+# Session tokens are signed with this key; set DISEASE_PREDICTION_SECRET_KEY to
+# keep them valid across restarts and between server processes
+SECRET_KEY = os.environ.get('DISEASE_PREDICTION_SECRET_KEY', '').encode() or secrets.token_bytes(32)
+SESSION_TTL = 15 * 60
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r * p + 2 ** 20)
+
+
+def hash_password(password):
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return (f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$"
+            f"{base64.b64encode(salt).decode()}${base64.b64encode(digest).decode()}")
+
+
+def is_legacy_hash(stored):
+    # The original login.py stored hashlib.sha256(password).hexdigest()
+    return len(stored) == 64 and all(c in '0123456789abcdef' for c in stored)
+
+
+def verify_password(password, stored):
+    # Returns (matches, needs_rehash)
+    if not stored:
+        return False, False
+    if stored.startswith('scrypt$'):
+        try:
+            _, n, r, p, salt, expected = stored.split('$')
+            n, r, p = int(n), int(r), int(p)
+            salt, expected = base64.b64decode(salt), base64.b64decode(expected)
+        except ValueError:
+            return False, False
+        matches = hmac.compare_digest(_scrypt(password, salt, n, r, p), expected)
+        return matches, matches and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    if is_legacy_hash(stored):
+        matches = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+        return matches, matches
+    return False, False
+
+
+class RateLimiter:
+    # Allows `max_attempts` unsuccessful logins per account within `window` seconds.
+    # Every attempt is counted up front, so parallel guesses can't slip past the
+    # limit; a successful login clears the account's count.
+    def __init__(self, max_attempts=5, window=300, max_accounts=100000):
+        self.max_attempts = max_attempts
+        self.window = window
+        self.max_accounts = max_accounts
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def _expire(self, key, now):
+        attempts = self._attempts.get(key)
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        if attempts is not None and not attempts:
+            del self._attempts[key]
+            attempts = None
+        return attempts
+
+    def attempt(self, key):
+        # Records an attempt and returns 0, or returns the seconds to wait if locked out
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._expire(key, now)
+            if attempts is not None and len(attempts) >= self.max_attempts:
+                return attempts[0] + self.window - now
+            if attempts is None:
+                if len(self._attempts) >= self.max_accounts:
+                    for other in list(self._attempts):
+                        self._expire(other, now)
+                attempts = self._attempts[key] = deque()
+            attempts.append(now)
+            return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+
+login_limiter = RateLimiter()
+
+
+def _b64url(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def _unb64url(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def issue_token(email, role, ttl=SESSION_TTL):
+    payload = _b64url(json.dumps({'email': email, 'role': role, 'exp': time.time() + ttl}).encode())
+    signature = hmac.new(SECRET_KEY, payload.encode(), hashlib.sha256).digest()
+    return f"{payload}.{_b64url(signature)}"
+
+
+def verify_token(token):
+    # Returns the token's claims ({'email', 'role', 'exp'}) if it is genuine and unexpired, else None
+    try:
+        payload, signature = token.split('.')
+        expected = hmac.new(SECRET_KEY, payload.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(_unb64url(signature), expected):
+            return None
+        claims = json.loads(_unb64url(payload))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+
+def _rehash(email, old_hash, password):
+    new_hash = hash_password(password)
+    # Only replace the hash that was just verified, in case the password changed in the meantime
+    get_pool(USERS_DB).submit_write(lambda conn: conn.execute(
+        "UPDATE users SET password = ? WHERE email = ? AND password = ?", (new_hash, email, old_hash)))
+
+
+def register_user(first_name, last_name, phone_number, email, password, role, clinic=DEFAULT_CLINIC):
+    if not CLINIC_ID.match(clinic):
+        return "Clinic IDs may only contain letters, digits, '-' and '_'."
+    # Registering never creates a clinic (see patient_shards.py); imported here to keep the login page light
+    from patient_shards import get_store
+
+    if clinic not in get_store().clinics():
+        return f"Unknown clinic '{clinic}'."
+    hashed_password = _kdf_pool.submit(hash_password, password).result()
+
+    # Runs in the batched writer, so the check and the insert are one transaction
+    def insert_user(conn):
+        if conn.execute("SELECT 1 FROM users WHERE email=?", (email,)).fetchone():
+            return "Email already exists!"
+        conn.execute("INSERT INTO users (first_name, last_name, phone_number, email, password, role, clinic) "
+                     "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                     (first_name, last_name, phone_number, email, hashed_password, role, clinic))
+        return "Registration successful! You can now log in."
+
+    return write(USERS_DB, insert_user)
+
+
+def user_clinic(email):
+    # The clinic whose patient shard the user's records belong to
+    with connection(USERS_DB) as conn:
+        row = conn.execute("SELECT clinic FROM users WHERE email=?", (email,)).fetchone()
+    return row[0] if row else DEFAULT_CLINIC
+
+
+def authenticate(email, password):
+    # Returns the user's role, or an error message to show
+    retry_after = login_limiter.attempt(email)
+    if retry_after:
+        return f"Too many failed attempts. Try again in {int(retry_after) + 1} seconds."
+
+    with connection(USERS_DB) as conn:
+        user = conn.execute("SELECT password, role FROM users WHERE email=?", (email,)).fetchone()
+    if user is None:
+        return "User not found"
+
+    stored, role = user
+    matches, needs_rehash = _kdf_pool.submit(verify_password, password, stored).result()
+    if not matches:
+        return "Incorrect password"
+
+    login_limiter.reset(email)
+    if needs_rehash:
+        # Upgrade legacy hashes without making this login wait for a second KDF call
+        _kdf_pool.submit(_rehash, email, stored, password)
+    return role
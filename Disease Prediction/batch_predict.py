@@ -0,0 +1,169 @@
+"""Headless batch scoring for the saved disease models.
+
+Scores CSV or Parquet intake files in fixed-size chunks and writes the
+diagnoses, with their risk scores, straight into the patients database
+used by the dashboards.
+
+The whole file is validated before the first chunk is written, so a file
+with invalid rows writes nothing. With --skip-invalid those rows are left
+out and reported instead, in a single pass.
+
+Example:
+    python batch_predict.py diabetes intake.csv --chunksize 10000
+    python batch_predict.py heart intake.csv --clinic nairobi-west
+    python batch_predict.py heart intake.csv --skip-invalid
+"""
+import argparse
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from db import PATIENTS_DB
+from diseases import DISEASES
+from feature_schema import check_rows, describe_invalid
+from inference_pipeline import get_pipeline
+from migrations import migrate
+from patient_store import add_diagnoses
+
+
+def read_chunks(path, chunksize):
+    # Yield DataFrames of at most `chunksize` rows without reading the whole file
+    if path.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Reading Parquet files requires pyarrow (pip install pyarrow)")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+
+def check_chunk(key, chunk, name_column, first_row):
+    # (X, valid row mask, problem description or None) for one chunk; rows are numbered from 1 in the file
+    if name_column not in chunk.columns:
+        raise ValueError(f"Input is missing the patient name column '{name_column}'")
+    X, bad = check_rows(key, chunk)
+    if not bad.any():
+        return X, None, None
+    return X, ~bad.any(axis=1), describe_invalid(key, X, bad, first_row)
+
+
+def validate_file(key, input_path, chunksize, name_column):
+    # Raises ValueError describing every chunk with invalid rows, before anything is written
+    problems = []
+    rows = 0
+    for chunk in read_chunks(input_path, chunksize):
+        problem = check_chunk(key, chunk, name_column, rows + 1)[2]
+        if problem:
+            problems.append(problem)
+        rows += len(chunk)
+    if problems:
+        shown = "\n".join(problems[:10])
+        more = f"\n... and {len(problems) - 10} more chunk(s)" if len(problems) > 10 else ""
+        raise ValueError(f"{input_path} has invalid rows, nothing was written "
+                         f"(use --skip-invalid to score the rest):\n{shown}{more}")
+
+
+def run_batch(key, input_path, db_path, chunksize=10000, name_column='name', output_path=None, verbose=True,
+              skip_invalid=False):
+    # Returns (rows scored, rows skipped as invalid, elapsed seconds)
+    info = DISEASES[key]
+    pipeline = get_pipeline(key)
+    negative, positive = info['diagnosis']
+
+    start = time.perf_counter()
+    if not skip_invalid:
+        validate_file(key, input_path, chunksize, name_column)
+
+    conn = sqlite3.connect(db_path)
+    migrate(conn)
+
+    total = skipped = rows = 0
+    write_header = True
+    try:
+        for chunk in read_chunks(input_path, chunksize):
+            X, valid, problem = check_chunk(key, chunk, name_column, rows + 1)
+            rows += len(chunk)
+            if problem:
+                skipped += len(chunk) - int(valid.sum())
+                if verbose:
+                    print(f"Skipping {len(chunk) - int(valid.sum())} invalid row(s): {problem}", file=sys.stderr)
+                X, chunk = X[valid], chunk[valid]
+                if not len(chunk):
+                    continue
+            # Labels, risks, decision values and contributions for the whole chunk at once
+            scores = pipeline.score(np.ascontiguousarray(X))
+            diagnoses = np.where(scores['prediction'] == 1, positive, negative)
+            names = chunk[name_column].astype(str).tolist()
+            contributions = scores['contributions']
+            if contributions is None:
+                contributions = [None] * len(names)
+            # Uncalibrated models have no risk; their records keep only the decision value
+            risks = [None] * len(names) if scores['risk'] is None else scores['risk'].tolist()
+
+            # One transaction per chunk
+            with conn:
+                add_diagnoses(conn, zip(names, [info['disease']] * len(names), diagnoses.tolist(),
+                                        risks, scores['score'].tolist(), contributions))
+
+            if output_path:
+                pd.DataFrame({'name': names, 'prediction': scores['prediction'], 'risk': risks,
+                              'score': scores['score']}).to_csv(
+                    output_path, mode='w' if write_header else 'a', header=write_header, index=False)
+                write_header = False
+
+            total += len(names)
+            if verbose:
+                elapsed = time.perf_counter() - start
+                print(f"{total} rows scored ({total / elapsed:,.0f} rows/sec)")
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - start
+    return total, skipped, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score intake files with the saved disease models.")
+    parser.add_argument('disease', choices=sorted(DISEASES))
+    parser.add_argument('input', help="CSV or .parquet file with one row per patient")
+    parser.add_argument('--db', default=PATIENTS_DB, help="SQLite database to write to")
+    parser.add_argument('--clinic', help="Write to this clinic's shard instead of --db (see patient_shards.py)")
+    parser.add_argument('--chunksize', type=int, default=10000)
+    parser.add_argument('--name-column', default='name')
+    parser.add_argument('--output', help="Optional CSV file for predictions and scores")
+    parser.add_argument('--skip-invalid', action='store_true',
+                        help="Score the valid rows and report the invalid ones instead of stopping")
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    db_path = args.db
+    if args.clinic:
+        from patient_shards import SQLiteShardBackend
+
+        backend = SQLiteShardBackend()
+        # Only existing clinics: a mistyped --clinic must not create a new one
+        if args.clinic not in backend.clinics():
+            parser.error(f"Unknown clinic {args.clinic!r}: add it with `python patient_shards.py add {args.clinic}`")
+        db_path = backend.path(args.clinic)
+
+    try:
+        total, skipped, elapsed = run_batch(args.disease, args.input, db_path, args.chunksize, args.name_column,
+                                            args.output, verbose=not args.quiet, skip_invalid=args.skip_invalid)
+    except (ValueError, OSError, sqlite3.Error) as e:
+        print(f"Batch scoring failed: {e}", file=sys.stderr)
+        return 1
+
+    rate = total / elapsed if elapsed else 0.0
+    print(f"Scored {total} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+    if skipped:
+        print(f"Skipped {skipped} invalid rows")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
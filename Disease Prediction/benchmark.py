@@ -0,0 +1,312 @@
+"""Reproducible benchmarks for the app's hot paths.
+
+Covers model inference (single row and batch), password hashing and logins
+per second under concurrency, the doctor dashboard's SQLite queries at
+several table sizes, PDF rendering and the overhead of metrics.py.
+Everything runs against synthetic patients in a temporary data directory, so
+the real databases are never touched. Results are written as JSON so runs
+from different commits can be compared:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+    python benchmark.py --only db --sizes 10000 100000 1000000
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Keep every database the benchmarks open out of the source tree. This has to
+# happen before db.py is imported.
+_data_dir = tempfile.mkdtemp(prefix='disease-bench-')
+os.environ['DISEASE_PREDICTION_DATA_DIR'] = _data_dir
+
+from diseases import DISEASES  # noqa: E402
+from feature_schema import random_rows  # noqa: E402
+
+def measure(fn, repeat=1000, warmup=10):
+    # Per-call latency statistics in microseconds
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return {
+        'calls': repeat,
+        'median_us': statistics.median(samples) * 1e6,
+        'p95_us': samples[int(0.95 * (len(samples) - 1))] * 1e6,
+        'ops_per_second': repeat / sum(samples),
+    }
+
+
+def throughput(fn, rows):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    return {'rows': rows, 'seconds': elapsed, 'rows_per_second': rows / elapsed}
+
+
+def bench_inference():
+    from inference_pipeline import get_pipeline
+    from model_registry import get_model
+    from prediction_cache import cached_predict
+
+    results = {}
+    for disease in DISEASES:
+        model = get_model(disease)
+        pipeline = get_pipeline(disease)
+        X = random_rows(disease, 100000)
+        row = X[:1]
+        row_list = X[0].tolist()
+        results[disease] = {
+            'sklearn_single_row': measure(lambda: model.predict(row), repeat=500),
+            'pipeline_single_row': measure(lambda: pipeline.predict(row)),
+            'cached_single_row': measure(lambda: cached_predict(disease, row_list)),
+            'sklearn_batch': throughput(lambda: model.predict(X), len(X)),
+            'pipeline_batch': throughput(lambda: pipeline.predict(X), len(X)),
+        }
+    return results
+
+
+def _fill_patients(conn, n_rows, chunk=50000):
+    # n_rows diagnoses spread over n_rows / 4 patients
+    from patient_store import add_diagnoses
+
+    rng = np.random.default_rng(0)
+    diseases = [info['disease'] for info in DISEASES.values()]
+    start = time.perf_counter()
+    for offset in range(0, n_rows, chunk):
+        size = min(chunk, n_rows - offset)
+        patient_ids = rng.integers(0, max(1, n_rows // 4), size=size)
+        risks = rng.random(size)
+        with conn:
+            add_diagnoses(conn, ((f"patient {pid:08d}", diseases[pid % 3], 'The person is not diabetic', risk,
+                                  float(np.log(risk / (1 - risk))))
+                                 for pid, risk in zip(patient_ids.tolist(), risks.tolist())))
+    return time.perf_counter() - start
+
+
+def bench_db(sizes):
+    from db import ConnectionPool
+    from migrations import migrate
+    from patient_store import add_diagnosis, daily_trend, disease_summary, list_by_risk, list_diagnoses, list_patients
+
+    results = {}
+    for size in sizes:
+        path = f"{_data_dir}/bench_{size}.db"
+        pool = ConnectionPool(path, setup=migrate)
+        with pool.connection() as conn:
+            elapsed = _fill_patients(conn, size)
+            patient_ids = [row[0] for row in conn.execute("SELECT id FROM patients ORDER BY random() LIMIT 1000")]
+            names = [row[0] for row in conn.execute("SELECT name FROM patients ORDER BY random() LIMIT 100")]
+
+            index = iter(range(10 ** 9))
+            result = {
+                'bulk_insert': {'rows': size, 'seconds': elapsed, 'rows_per_second': size / elapsed},
+                'list_patients_first_page': measure(lambda: list_patients(conn), repeat=200),
+                'list_patients_deep_page': measure(
+                    lambda: list_patients(conn, after_name=names[next(index) % len(names)]), repeat=200),
+                'list_diagnoses': measure(
+                    lambda: list_diagnoses(conn, patient_ids[next(index) % len(patient_ids)]), repeat=500),
+                'list_by_risk_all': measure(lambda: list_by_risk(conn), repeat=200),
+                'list_by_risk_disease': measure(lambda: list_by_risk(conn, 'Parkinsons', 0.9), repeat=200),
+                'disease_summary': measure(lambda: disease_summary(conn), repeat=200),
+                'daily_trend': measure(lambda: daily_trend(conn), repeat=200),
+                'disease_summary_full_scan': measure(
+                    lambda: conn.execute("SELECT disease, COUNT(*), AVG(risk) FROM diagnoses GROUP BY disease").fetchall(),
+                    repeat=3, warmup=1),
+                'legacy_distinct_names': measure(
+                    lambda: conn.execute("SELECT DISTINCT name FROM patient_data").fetchall(), repeat=3, warmup=1),
+            }
+        result['single_insert_batched_writer'] = measure(
+            lambda: pool.write(lambda conn: add_diagnosis(conn, f"single {next(index)}", 'Diabetes', 'x')),
+            repeat=200)
+        results[str(size)] = result
+    return results
+
+
+def concurrent_logins(authenticate, emails, threads):
+    # Logins per second with `threads` sessions logging in at once
+    from concurrent.futures import ThreadPoolExecutor
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        roles = list(pool.map(lambda email: authenticate(email, 'password'), emails))
+    elapsed = time.perf_counter() - start
+    assert all(role == 'patient' for role in roles), set(roles)
+    return {'threads': threads, 'logins': len(emails), 'seconds': elapsed, 'logins_per_second': len(emails) / elapsed}
+
+
+def bench_auth(users=100, concurrency=(1, 4, 16)):
+    from concurrent.futures import ThreadPoolExecutor
+
+    import auth
+
+    emails = [f"user{i}@bench.test" for i in range(users)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda email: auth.register_user('Bench', 'User', '000', email, 'password', 'patient'), emails))
+    stored = auth.hash_password('password')
+    legacy = hashlib.sha256(b'password').hexdigest()
+    token = auth.issue_token(emails[0], 'patient')
+    index = iter(range(10 ** 9))
+
+    results = {
+        'hash_password': measure(lambda: auth.hash_password('password'), repeat=20, warmup=1),
+        'verify_scrypt': measure(lambda: auth.verify_password('password', stored), repeat=20, warmup=1),
+        'verify_legacy_sha256': measure(lambda: auth.verify_password('password', legacy)),
+        'verify_session_token': measure(lambda: auth.verify_token(token)),
+        'register_user': measure(
+            lambda: auth.register_user('Bench', 'User', '000', f"new{next(index)}@bench.test", 'password', 'patient'),
+            repeat=20, warmup=1),
+        'authenticate_unknown_user': measure(lambda: auth.authenticate(f"nobody{next(index)}@bench.test", 'password'),
+                                             repeat=200),
+    }
+    for threads in concurrency:
+        results[f"logins_{threads}_threads"] = concurrent_logins(auth.authenticate, emails, threads)
+
+    # Once an account is locked out, further attempts are refused before the KDF runs
+    for _ in range(auth.login_limiter.max_attempts):
+        auth.authenticate(emails[0], 'wrong')
+    results['authenticate_locked_out'] = measure(lambda: auth.authenticate(emails[0], 'password'), repeat=200)
+    return results
+
+
+def bench_reports(count=50):
+    import report_service
+
+    reports_dir = f"{_data_dir}/reports"
+    patient = {"Name": "Bench Patient", "Disease": "Diabetes", "Diagnosis": "The person is not diabetic"}
+    index = iter(range(10 ** 9))
+    return {
+        'render_pdf': measure(
+            lambda: report_service.render_pdf(patient, "Rest and hydrate. " * 20,
+                                              f"{reports_dir}/{next(index)}.pdf"),
+            repeat=count, warmup=2),
+    }
+
+
+def bench_metrics():
+    # What the instrumentation costs on the single-row scoring path, with collection off and on
+    import metrics
+    from inference_pipeline import get_pipeline
+
+    pipeline = get_pipeline('heart')
+    row = random_rows('heart', 1)
+
+    def empty_timer():
+        with metrics.timer('bench_seconds', kind='empty'):
+            pass
+
+    results = {}
+    try:
+        for state in ('disabled', 'enabled'):
+            if state == 'enabled':
+                metrics.enable()
+            results[state] = {
+                'empty_timer': measure(empty_timer, repeat=10000),
+                'pipeline_score_single_row': measure(lambda: pipeline.score(row), repeat=5000),
+            }
+    finally:
+        metrics.disable()
+        metrics.registry.reset()
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    versions = {}
+    for module in ('numpy', 'sklearn', 'streamlit', 'fpdf'):
+        try:
+            versions[module] = getattr(__import__(module), '__version__', None)
+        except ImportError:
+            versions[module] = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'packages': versions,
+    }
+
+
+def _flatten(results, prefix=''):
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from _flatten(value, name)
+        else:
+            yield name, value
+
+
+def compare(current, baseline):
+    # Print the change in every latency/throughput figure present in both runs
+    old = dict(_flatten(baseline['results']))
+    for name, value in _flatten(current['results']):
+        if name not in old or not name.endswith(('median_us', 'rows_per_second', 'ops_per_second')):
+            continue
+        if not old[name]:
+            continue
+        change = (value - old[name]) / old[name]
+        better = change < 0 if name.endswith('_us') else change > 0
+        flag = '' if abs(change) < 0.10 else (' faster' if better else ' SLOWER')
+        print(f"{name:70s} {old[name]:14.1f} -> {value:14.1f} ({change:+.0%}){flag}")
+
+
+BENCHMARKS = ['inference', 'db', 'auth', 'reports', 'metrics']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark inference, database, auth, report rendering and metrics.")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10000, 100000],
+                        help="patient_data sizes for the database benchmark (e.g. 10000 100000 1000000)")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    results = {}
+    try:
+        for name in args.only:
+            print(f"Running {name} benchmarks...", file=sys.stderr)
+            if name == 'inference':
+                results[name] = bench_inference()
+            elif name == 'db':
+                results[name] = bench_db(args.sizes)
+            elif name == 'auth':
+                results[name] = bench_auth()
+            elif name == 'reports':
+                results[name] = bench_reports()
+            elif name == 'metrics':
+                results[name] = bench_metrics()
+    finally:
+        shutil.rmtree(_data_dir, ignore_errors=True)
+
+    output = {'environment': environment(), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(output, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
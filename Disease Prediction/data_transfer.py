@@ -0,0 +1,455 @@
+"""Streaming export and resumable bulk import of users and patient records.
+
+Exports read each database through one cursor with fetchmany(), so memory
+use is bounded by --chunksize rows whatever the table size. The users table
+and the patient_data view can be written to CSV, JSONL or Parquet (pyarrow),
+chosen by the file extension. Patient records come from every clinic's shard
+with a `clinic` column. Password hashes are only exported with
+--with-passwords.
+
+    python data_transfer.py export patient_data records.parquet
+    python data_transfer.py export users users.csv --with-passwords
+
+Imports validate every row and insert each chunk in one transaction through
+the database's batched writer. The same transaction records how far into the
+file the import has got, keyed by the file's sha256, in an import_progress
+table of each database written to. Rerunning an interrupted import therefore
+skips the rows that were already committed and carries on, and importing the
+same file twice adds nothing. Records go to the shard named in their `clinic`
+column, or --clinic if there is none. Rows naming a clinic that does not
+exist are invalid; clinics are added with `patient_shards.py add`. Users
+whose email already exists are left as they are.
+
+    python data_transfer.py import patient_data records.jsonl
+    python data_transfer.py import users users.csv --dry-run
+"""
+import argparse
+import csv
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+
+from db import CLINIC_ID, DEFAULT_CLINIC, USERS_DB, connection, get_pool
+from diseases import DISEASES
+
+# Exported columns and their types ('text', 'int' or 'float')
+COLUMNS = {
+    'users': [('email', 'text'), ('first_name', 'text'), ('last_name', 'text'), ('phone_number', 'text'),
+              ('role', 'text'), ('clinic', 'text'), ('password', 'text')],
+    'patient_data': [('clinic', 'text'), ('id', 'int'), ('name', 'text'), ('disease', 'text'),
+                     ('diagnosis', 'text'), ('recommendations', 'text'), ('created_at', 'text'),
+                     ('risk', 'float'), ('score', 'float')],
+}
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.parquet': 'parquet'}
+
+ROLES = ('patient', 'doctor')
+
+# The diagnosis texts each disease may be recorded with
+DIAGNOSES = {info['disease']: info['diagnosis'] for info in DISEASES.values()}
+
+# SQLite's CURRENT_TIMESTAMP format, which the daily summaries' date() calls expect
+TIMESTAMP = re.compile(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d')
+
+DEFAULT_CHUNKSIZE = 5000
+
+
+def file_format(path, fmt=None):
+    fmt = fmt or FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt not in FORMATS.values():
+        raise ValueError(f"Can't tell the format of {path}: use a .csv, .jsonl or .parquet file or --format")
+    return fmt
+
+
+def column_names(table, with_passwords=False):
+    return [name for name, _ in COLUMNS[table] if with_passwords or name != 'password']
+
+
+def _fetch_chunks(cursor, chunksize):
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            return
+        yield rows
+
+
+def iter_chunks(table, chunksize=DEFAULT_CHUNKSIZE, clinics=None, with_passwords=False):
+    # Yields lists of at most `chunksize` row tuples in column_names() order.
+    # Each database is read by a single statement, i.e. from one consistent snapshot.
+    names = column_names(table, with_passwords)
+    if table == 'users':
+        with connection(USERS_DB) as conn:
+            yield from _fetch_chunks(conn.execute(f"SELECT {', '.join(names)} FROM users ORDER BY email"),
+                                     chunksize)
+        return
+
+    from patient_shards import get_store
+
+    store = get_store()
+    if clinics is None:
+        clinics = store.clinics()
+    else:
+        # Opening an unknown clinic's pool would create an empty shard
+        unknown = sorted(set(clinics) - set(store.clinics()))
+        if unknown:
+            raise ValueError(f"Unknown clinic(s): {', '.join(unknown)}")
+    for clinic in clinics:
+        with store.pool(clinic).connection() as conn:
+            cursor = conn.execute(f"SELECT ?, {', '.join(names[1:])} FROM patient_data ORDER BY id", (clinic,))
+            yield from _fetch_chunks(cursor, chunksize)
+
+
+def _write_csv(path, columns, chunks):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in columns])
+        for rows in chunks:
+            writer.writerows(rows)
+            yield len(rows)
+
+
+def _write_jsonl(path, columns, chunks):
+    names = [name for name, _ in columns]
+    with open(path, 'w', encoding='utf-8') as f:
+        for rows in chunks:
+            f.write(''.join(json.dumps(dict(zip(names, row)), ensure_ascii=False) + '\n' for row in rows))
+            yield len(rows)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit("Parquet files require pyarrow (pip install pyarrow)")
+    return pa, pq
+
+
+def _write_parquet(path, columns, chunks):
+    # One row group per chunk
+    pa, pq = _import_pyarrow()
+    types = {'text': pa.string(), 'int': pa.int64(), 'float': pa.float64()}
+    schema = pa.schema([(name, types[kind]) for name, kind in columns])
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in chunks:
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield len(rows)
+
+
+WRITERS = {'csv': _write_csv, 'jsonl': _write_jsonl, 'parquet': _write_parquet}
+
+
+def export(table, path, fmt=None, chunksize=DEFAULT_CHUNKSIZE, clinics=None, with_passwords=False, verbose=True):
+    # Returns (rows written, seconds). The file only appears once it is complete.
+    fmt = file_format(path, fmt)
+    columns = [(name, kind) for name, kind in COLUMNS[table] if with_passwords or name != 'password']
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    total = 0
+    start = time.perf_counter()
+    try:
+        for count in WRITERS[fmt](tmp_path, columns, iter_chunks(table, chunksize, clinics, with_passwords)):
+            total += count
+            if verbose:
+                print(f"{total} rows exported ({total / (time.perf_counter() - start):,.0f} rows/sec)")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return total, time.perf_counter() - start
+
+
+def _read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        yield from csv.DictReader(f)
+
+
+def _read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path} line {line_number} is not valid JSON: {e}")
+            if not isinstance(row, dict):
+                raise ValueError(f"{path} line {line_number} is not a JSON object")
+            yield row
+
+
+def _read_parquet(path, batch_size=DEFAULT_CHUNKSIZE):
+    _, pq = _import_pyarrow()
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+READERS = {'csv': _read_csv, 'jsonl': _read_jsonl, 'parquet': _read_parquet}
+
+
+def fingerprint(path):
+    # sha256 of the file's contents; an import's progress is keyed by it
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _missing(value):
+    # CSV has no null, so empty strings count as missing; Parquet files written by pandas use NaN
+    return value is None or value == '' or (isinstance(value, float) and math.isnan(value))
+
+
+def _text(row, name, required=True):
+    value = row.get(name)
+    if _missing(value):
+        if required:
+            raise ValueError(f"'{name}' is required")
+        return None
+    # e.g. phone numbers that a JSON file holds as numbers
+    return value if isinstance(value, str) else str(value)
+
+
+def _number(row, name):
+    value = row.get(name)
+    if _missing(value):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be a number, got {value!r}")
+    if not math.isfinite(number):
+        raise ValueError(f"'{name}' must be finite, got {value!r}")
+    return number
+
+
+def _clinic(row, default, clinics):
+    # Only existing clinics: importing never creates one
+    clinic = _text(row, 'clinic', required=False) or default
+    if not CLINIC_ID.match(clinic):
+        raise ValueError(f"'clinic' must be letters, digits, '-' and '_', got {clinic!r}")
+    if clinic not in clinics:
+        raise ValueError(f"Unknown clinic {clinic!r}: add it with `python patient_shards.py add {clinic}`")
+    return clinic
+
+
+def _check_user(row, clinics):
+    from auth import is_legacy_hash
+
+    email = _text(row, 'email').strip()
+    role = _text(row, 'role')
+    if role not in ROLES:
+        raise ValueError(f"'role' must be one of {', '.join(ROLES)}, got {role!r}")
+    password = _text(row, 'password')
+    # Only hashes are imported, never plain-text passwords
+    if not (password.startswith('scrypt$') or is_legacy_hash(password)):
+        raise ValueError("'password' must be a password hash as exported with --with-passwords")
+    return (email, _text(row, 'first_name', required=False), _text(row, 'last_name', required=False),
+            _text(row, 'phone_number', required=False), password, role, _clinic(row, DEFAULT_CLINIC, clinics))
+
+
+def _check_record(row):
+    name = _text(row, 'name')
+    disease = _text(row, 'disease')
+    if disease not in DIAGNOSES:
+        raise ValueError(f"'disease' must be one of {', '.join(DIAGNOSES)}, got {disease!r}")
+    diagnosis = _text(row, 'diagnosis')
+    if diagnosis not in DIAGNOSES[disease]:
+        raise ValueError(f"'diagnosis' for {disease} must be one of {DIAGNOSES[disease]}, got {diagnosis!r}")
+    risk = _number(row, 'risk')
+    if risk is not None and not 0.0 <= risk <= 1.0:
+        raise ValueError(f"'risk' must be between 0 and 1, got {risk:g}")
+    created_at = _text(row, 'created_at', required=False)
+    if created_at is not None:
+        try:
+            if not TIMESTAMP.fullmatch(created_at):
+                raise ValueError
+            datetime.fromisoformat(created_at)
+        except ValueError:
+            raise ValueError(f"'created_at' must look like 2024-01-31 13:45:00, got {created_at!r}")
+    return (name, disease, diagnosis, _text(row, 'recommendations', required=False), created_at, risk,
+            _number(row, 'score'))
+
+
+def _insert_users(conn, rows):
+    # Returns how many were new
+    return conn.executemany(
+        "INSERT OR IGNORE INTO users (email, first_name, last_name, phone_number, password, role, clinic) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows
+    ).rowcount
+
+
+def _insert_records(conn, rows):
+    conn.executemany("INSERT OR IGNORE INTO patients (name) VALUES (?)", ((row[0],) for row in rows))
+    conn.executemany(
+        "INSERT INTO diagnoses (patient_id, disease, diagnosis, recommendations, created_at, risk, score) "
+        "VALUES ((SELECT id FROM patients WHERE name = ?), ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?)",
+        rows
+    )
+    return len(rows)
+
+
+def committed_rows(conn, source):
+    # How many rows of `source` an earlier import committed to this database
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'import_progress'").fetchone():
+        return 0
+    row = conn.execute("SELECT rows FROM import_progress WHERE source = ?", (source,)).fetchone()
+    return row[0] if row else 0
+
+
+def _save_progress(conn, source, rows):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS import_progress (
+        source TEXT PRIMARY KEY,
+        rows INTEGER NOT NULL,
+        updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute(
+        "INSERT INTO import_progress (source, rows) VALUES (?, ?) "
+        "ON CONFLICT (source) DO UPDATE SET rows = excluded.rows, updated_at = CURRENT_TIMESTAMP",
+        (source, rows)
+    )
+
+
+def import_file(table, path, fmt=None, chunksize=DEFAULT_CHUNKSIZE, clinic=DEFAULT_CLINIC, skip_invalid=False,
+                dry_run=False, restart=False, verbose=True):
+    # Returns a dict of row counts and the elapsed seconds
+    fmt = file_format(path, fmt)
+    source = f"{table}:{fingerprint(path)}"
+    from patient_shards import get_store
+
+    clinics = set(get_store().clinics())
+    if table == 'users':
+        pool_of, insert = get_pool, _insert_users
+
+        def check(row):
+            return _check_user(row, clinics)
+
+        def route(row):
+            return USERS_DB
+    else:
+        pool_of, check, insert = get_store().pool, _check_record, _insert_records
+
+        def route(row):
+            return _clinic(row, clinic, clinics)
+
+    # Rows before committed[target] were written to that database by an earlier run. Every
+    # chunk commits separately per database, so the counts may differ between shards.
+    committed = {}
+    counts = {'rows': 0, 'inserted': 0, 'already_imported': 0, 'invalid': 0}
+    start = time.perf_counter()
+    rows = iter(READERS[fmt](path))
+    while True:
+        chunk = list(islice(rows, chunksize))
+        if not chunk:
+            break
+        first, end = counts['rows'], counts['rows'] + len(chunk)
+        batches = {}
+        for index, row in enumerate(chunk, start=first):
+            try:
+                target = route(row)
+                if target not in committed:
+                    if dry_run or restart:
+                        committed[target] = 0
+                    else:
+                        with pool_of(target).connection() as conn:
+                            committed[target] = committed_rows(conn, source)
+                if index < committed[target]:
+                    counts['already_imported'] += 1
+                    continue
+                batches.setdefault(target, []).append(check(row))
+            except ValueError as e:
+                if not skip_invalid:
+                    raise ValueError(f"{path} row {index + 1}: {e}")
+                counts['invalid'] += 1
+                if verbose and counts['invalid'] <= 10:
+                    print(f"Skipping {path} row {index + 1}: {e}", file=sys.stderr)
+
+        for target, batch in batches.items():
+            if dry_run:
+                continue
+
+            # The rows and the new progress commit in one transaction
+            def write_chunk(conn, batch=batch):
+                inserted = insert(conn, batch)
+                _save_progress(conn, source, end)
+                return inserted
+
+            counts['inserted'] += pool_of(target).write(write_chunk)
+
+        counts['rows'] = end
+        if verbose:
+            elapsed = time.perf_counter() - start
+            print(f"{end} rows {'checked' if dry_run else 'imported'} ({end / elapsed:,.0f} rows/sec)")
+    return counts, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import users and patient records.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help="Stream a table to a CSV, JSONL or Parquet file")
+    export_parser.add_argument('table', choices=sorted(COLUMNS))
+    export_parser.add_argument('path')
+    export_parser.add_argument('--clinic', action='append', dest='clinics',
+                               help="Only export this clinic's records (repeatable; default: every clinic)")
+    export_parser.add_argument('--with-passwords', action='store_true',
+                               help="Include password hashes, which importing users requires")
+
+    import_parser = commands.add_parser('import', help="Validate and insert the rows of a file in chunks")
+    import_parser.add_argument('table', choices=sorted(COLUMNS))
+    import_parser.add_argument('path')
+    import_parser.add_argument('--clinic', default=DEFAULT_CLINIC,
+                               help="Clinic for records without a clinic column")
+    import_parser.add_argument('--skip-invalid', action='store_true',
+                               help="Skip rows that fail validation instead of stopping")
+    import_parser.add_argument('--dry-run', action='store_true', help="Only validate the file")
+    import_parser.add_argument('--restart', action='store_true',
+                               help="Ignore the progress of earlier runs and import every row again")
+
+    for command in (export_parser, import_parser):
+        command.add_argument('--format', choices=sorted(FORMATS.values()), help="Default: from the extension")
+        command.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help="Rows per fetch or transaction")
+        command.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        try:
+            total, elapsed = export(args.table, args.path, args.format, args.chunksize, args.clinics,
+                                    args.with_passwords, verbose=not args.quiet)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Export failed: {e}", file=sys.stderr)
+            return 1
+        rate = total / elapsed if elapsed else 0.0
+        print(f"Exported {total} rows to {args.path} in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+        return 0
+
+    try:
+        counts, elapsed = import_file(args.table, args.path, args.format, args.chunksize, args.clinic,
+                                      args.skip_invalid, args.dry_run, args.restart, verbose=not args.quiet)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"Import failed: {e}", file=sys.stderr)
+        print("Chunks committed before the failure are kept and are skipped if the same file is imported again.",
+              file=sys.stderr)
+        return 1
+    rate = counts['rows'] / elapsed if elapsed else 0.0
+    if args.dry_run:
+        print(f"Checked {counts['rows']} rows ({counts['invalid']} invalid) in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+        return 0
+    print(f"Imported {counts['inserted']} of {counts['rows']} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec); "
+          f"{counts['already_imported']} already imported, {counts['invalid']} invalid")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""Shared SQLite access for the dashboards, login and batch jobs.
+
+Every database gets one ConnectionPool per process. Reads check a connection
+out of the pool for the duration of a `with` block. Writes are handed to a
+single writer thread per database, which groups the writes that arrive within
+a few milliseconds of each other into one short transaction. Every
+connection runs in WAL mode with synchronous=NORMAL, so readers never block
+the writer and commits don't wait for a full fsync.
+
+    with connection(PATIENTS_DB) as conn:
+        rows = conn.execute("SELECT ...").fetchall()
+
+    write(PATIENTS_DB, lambda conn: conn.execute("INSERT ...", params))
+
+Query timing hooks registered with add_query_hook(hook) are called as
+hook(db_path, sql, seconds, failed) after each execute/executemany (see
+metrics.py).
+"""
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from migrations import migrate, migrate_users
+
+# Getting the working directory of the script
+working_dir = os.path.dirname(os.path.abspath(__file__))
+
+# The databases live next to the code unless DISEASE_PREDICTION_DATA_DIR is set
+data_dir = os.environ.get('DISEASE_PREDICTION_DATA_DIR', working_dir)
+
+PATIENTS_DB = f"{data_dir}/patients_data.db"
+USERS_DB = f"{data_dir}/main_app.db"
+
+# Per-clinic patient databases (see patient_shards.py); the default clinic uses PATIENTS_DB
+SHARDS_DIR = f"{data_dir}/shards"
+DEFAULT_CLINIC = 'default'
+
+# Clinic ids become shard file names, so they are restricted to a safe alphabet
+CLINIC_ID = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$')
+
+# Schema setup run once per process when a database is first opened
+SETUP = {
+    PATIENTS_DB: migrate,
+    USERS_DB: migrate_users,
+}
+
+_query_hooks = []
+
+
+def add_query_hook(hook):
+    _query_hooks.append(hook)
+
+
+def remove_query_hook(hook):
+    _query_hooks.remove(hook)
+
+
+class TimedConnection(sqlite3.Connection):
+    # Only pays for timing when at least one hook is registered
+    def execute(self, sql, parameters=()):
+        if not _query_hooks:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        failed = True
+        try:
+            cursor = super().execute(sql, parameters)
+            failed = False
+            return cursor
+        finally:
+            _run_hooks(self.db_path, sql, time.perf_counter() - start, failed)
+
+    def executemany(self, sql, parameters):
+        if not _query_hooks:
+            return super().executemany(sql, parameters)
+        start = time.perf_counter()
+        failed = True
+        try:
+            cursor = super().executemany(sql, parameters)
+            failed = False
+            return cursor
+        finally:
+            _run_hooks(self.db_path, sql, time.perf_counter() - start, failed)
+
+
+def _run_hooks(db_path, sql, seconds, failed):
+    for hook in list(_query_hooks):
+        hook(db_path, sql, seconds, failed)
+
+
+class ConnectionPool:
+    def __init__(self, db_path, size=8, setup=None):
+        self.db_path = db_path
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._writer = None
+        self._lock = threading.Lock()
+
+        # Open the first connection now so setup (e.g. migrations) runs once
+        # and connection errors surface immediately
+        conn = self._connect()
+        if setup is not None:
+            setup(conn)
+            conn.commit()
+        self._idle.put(conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, factory=TimedConnection)
+        conn.db_path = self.db_path
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            # Never hand out a connection with a transaction left open
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def write(self, fn):
+        return self.submit_write(fn).result()
+
+    def submit_write(self, fn):
+        with self._lock:
+            if self._writer is None:
+                self._writer = WriteBatcher(self)
+        return self._writer.submit(fn)
+
+
+class WriteBatcher:
+    # Group commit: one thread applies queued writes in short transactions,
+    # each write inside its own savepoint so one failure doesn't undo the rest
+    def __init__(self, pool, max_batch=100, max_delay=0.005):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"sqlite-writer-{os.path.basename(pool.db_path)}",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, fn):
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                with self.pool.connection() as conn:
+                    self._apply(conn, batch)
+            except Exception as e:
+                # e.g. no connection could be opened: fail this batch and keep serving later writes
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _apply(self, conn, batch):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, future in batch:
+                conn.execute("SAVEPOINT batched_write")
+                try:
+                    results.append((future, fn(conn), None))
+                    conn.execute("RELEASE batched_write")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO batched_write")
+                    conn.execute("RELEASE batched_write")
+                    results.append((future, None, e))
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        # Only report success once the transaction is committed
+        for future, result, error in results:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path=PATIENTS_DB, setup=None):
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_path)
+            if pool is None:
+                pool = ConnectionPool(db_path, setup=setup or SETUP.get(db_path))
+                _pools[db_path] = pool
+    return pool
+
+
+def connection(db_path=PATIENTS_DB):
+    return get_pool(db_path).connection()
+
+
+def write(db_path, fn):
+    return get_pool(db_path).write(fn)
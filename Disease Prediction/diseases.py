@@ -0,0 +1,25 @@
+"""The three supported diseases: labels, model feature order and diagnosis text."""
+from feature_schema import feature_names
+
+# Feature columns come from feature_schema.py, in the order the models expect.
+# `label` is the outcome column in the training datasets used by the notebooks.
+DISEASES = {
+    'diabetes': {
+        'disease': 'Diabetes',
+        'features': feature_names('diabetes'),
+        'label': 'Outcome',
+        'diagnosis': ('The person is not diabetic', 'The person is diabetic'),
+    },
+    'heart': {
+        'disease': 'Heart Disease',
+        'features': feature_names('heart'),
+        'label': 'target',
+        'diagnosis': ('The person does not have heart disease', 'The person has heart disease'),
+    },
+    'parkinsons': {
+        'disease': 'Parkinsons',
+        'features': feature_names('parkinsons'),
+        'label': 'status',
+        'diagnosis': ('The person does not have Parkinsons disease', 'The person has Parkinsons disease'),
+    },
+}
@@ -1,97 +1,406 @@
 import streamlit as st
-import sqlite3
-from fpdf import FPDF
+import datetime
 import os
 
-# Database connection
-working_dir = os.path.dirname(os.path.abspath(__file__))
-conn = sqlite3.connect("patients_data.db", check_same_thread=False)
-cursor = conn.cursor()
+import metrics
+import rerun_stats
+from db import DEFAULT_CLINIC
+from diseases import DISEASES
+from patient_shards import get_store
+from patient_store import PAGE_SIZE, decode_contributions, get_diagnosis, list_diagnoses, set_recommendations
+from prediction_cache import prediction_cache
+from report_service import get_report_service, reports_dir
 
+# Each clinic's shard is opened (and migrated) on first use, not at import time
 
+# Let every doctor view all clinics' patients instead of only their own clinic's
+CROSS_CLINIC_DOCTORS = os.environ.get('DISEASE_PREDICTION_CROSS_CLINIC_DOCTORS') == '1'
 
-def generate_pdf(patient_data, recommendations):
-    pdf = FPDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=12)
-    pdf.cell(200, 10, txt="Patient Diagnosis Report", ln=True, align='C')
-    pdf.ln(10)
+# Model feature names by the disease label stored with each record
+FEATURES = {info['disease']: info['features'] for info in DISEASES.values()}
 
-    # Add patient data
-    for key, value in patient_data.items():
-        pdf.cell(0, 10, txt=f"{key}: {value}", ln=True)
+# Listings are cached across doctor sessions. Each cache key includes the store's write versions
+# of the clinics involved, so a diagnosis or recommendation saved through get_store() invalidates
+# it at once. The ttl bounds how stale writes from other processes (e.g. batch_predict.py) can be.
+CACHE_TTL = 60
 
-    pdf.ln(10)
-    pdf.cell(0, 10, txt="Doctor's Recommendations:", ln=True)
-    pdf.multi_cell(0, 10, txt=recommendations)
+@st.cache_data(ttl=CACHE_TTL, max_entries=1000, show_spinner=False)
+def cached_patients(versions, clinics, search, after, limit):
+    return get_store().list_patients(after, limit, prefix=search, clinics=clinics)
 
-    # Save PDF file
-    file_path = f"{working_dir}/reports/{patient_data['Name']}_report.pdf"
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    pdf.output(file_path)
-    return file_path
+@st.cache_data(ttl=CACHE_TTL, max_entries=1000, show_spinner=False)
+def cached_records(versions, clinic, patient_id, after, limit):
+    return fetch_rows(clinic, list_diagnoses, patient_id, after or 0, limit)
 
-def doctor_dashboard():
-    st.title("Doctor's Dashboard")
+@st.cache_data(ttl=CACHE_TTL, max_entries=1000, show_spinner=False)
+def cached_diagnosis(versions, clinic, record_id):
+    return fetch_rows(clinic, get_diagnosis, record_id)
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=1000, show_spinner=False)
+def cached_risk_ranking(versions, clinics, disease, min_risk, after, limit):
+    return get_store().list_by_risk(disease, min_risk, after, limit, clinics=clinics)
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=100, show_spinner=False)
+def cached_summary(versions, clinics):
+    return get_store().disease_summary(clinics)
+
+@st.cache_data(ttl=CACHE_TTL, max_entries=100, show_spinner=False)
+def cached_trend(versions, clinics, since):
+    return get_store().daily_trend(since, clinics)
+
+
+# How often a page with reports still rendering checks on them
+REPORT_POLL_SECONDS = 2
+
+def reports_pending(job_ids):
+    return any(get_report_service().status(job_id)[0] in ('queued', 'running') for job_id in job_ids)
+
+@rerun_stats.fragment('doctor/report_status', run_every=REPORT_POLL_SECONDS)
+def poll_report_status(job_id):
+    state, _ = get_report_service().status(job_id)
+    if state in ('queued', 'running'):
+        st.info(f"Report is {state}...")
+    else:
+        # Finished: rerun the page once to show the result, which also stops the polling
+        st.rerun(scope='app')
+
+def show_report_status(job_id, file_name):
+    state, result = get_report_service().status(job_id)
+    if state in ('queued', 'running'):
+        poll_report_status(job_id)
+    elif state == 'done':
+        st.success("Report generated successfully!")
+        with open(result, "rb") as f:
+            st.download_button(
+                label="Download Report",
+                data=f,
+                file_name=file_name,
+                mime="application/pdf",
+                key=f"download_{job_id}"
+            )
+    elif state == 'failed':
+        st.error(f"Report generation failed: {result}")
+    else:
+        st.warning("The report is no longer available. Please generate it again.")
+
+def fetch_rows(clinic, query, *args, **kwargs):
+    # Run one patient_store query on the clinic's shard
+    return get_store().read(clinic, query, *args, **kwargs)
+
+def select_clinics():
+    # A doctor sees their own clinic's patients. Deployments where doctors work across clinics set
+    # CROSS_CLINIC_DOCTORS, which offers every clinic, and all of them at once, starting from their own.
+    # None means every clinic; listings and analytics fan out across their shards.
+    own = st.session_state.get("clinic", DEFAULT_CLINIC)
+    clinics = get_store().clinics()
+    if not CROSS_CLINIC_DOCTORS or clinics == [own]:
+        return [own]
+    options = ["All clinics"] + clinics
+    clinic = st.selectbox("Clinic", options, index=options.index(own) if own in clinics else 0, key="clinic_filter")
+    return None if clinic == "All clinics" else [clinic]
+
+def keyset_page(state_key, fetch, cursor_of):
+    # Fetch one page plus one extra row to know whether there is a next page
+    cursors = st.session_state.setdefault(state_key, [None])
+    rows = fetch(cursors[-1], PAGE_SIZE + 1)
+    has_next = len(rows) > PAGE_SIZE
+    rows = rows[:PAGE_SIZE]
+
+    col1, col2 = st.columns(2)
+    if col1.button("Previous page", key=f"{state_key}_prev", disabled=len(cursors) == 1):
+        cursors.pop()
+        rerun_stats.rerun()
+    if col2.button("Next page", key=f"{state_key}_next", disabled=not has_next):
+        cursors.append(cursor_of(rows[-1]))
+        rerun_stats.rerun()
+    return rows
+
+def show_top_factors(clinic, record_id, top=5):
+    # The features that pushed this prediction the most, from the stored contributions
+    record = cached_diagnosis(get_store().versions([clinic]), clinic, record_id)
+    contributions = decode_contributions(record[8]) if record else None
+    features = FEATURES.get(record[2]) if record else None
+    if contributions is None or features is None or len(features) != len(contributions):
+        return
+    order = sorted(range(len(features)), key=lambda i: abs(contributions[i]), reverse=True)[:top]
+    with st.expander("Top factors for the latest record"):
+        st.bar_chart({"Contribution": {features[i]: float(contributions[i]) for i in order}}, horizontal=True)
+
+@rerun_stats.fragment('doctor/risk')
+def show_risk_ranking(clinics=None):
+    # Highest-risk records first, paged through the (disease, risk) index of every shard
+    st.subheader("Patients by Risk")
+    st.caption("Only records scored by a calibrated model have a risk and are listed here.")
+    col1, col2 = st.columns(2)
+    disease = col1.selectbox("Disease", ["All"] + list(FEATURES), key="risk_disease")
+    min_risk = col2.slider("Minimum risk", 0.0, 1.0, 0.5, 0.05, key="risk_min")
+    disease = None if disease == "All" else disease
+    rows = keyset_page(
+        f"risk_pages_{clinics}_{disease}_{min_risk}",
+        lambda after, limit: cached_risk_ranking(get_store().versions(clinics), clinics, disease, min_risk, after,
+                                                 limit),
+        lambda row: (row[5], row[0], row[1])
+    )
+    if not rows:
+        st.info("No scored records at or above this risk.")
+        return
+    st.dataframe(
+        {
+            "Clinic": [row[0] for row in rows],
+            "Record": [row[1] for row in rows],
+            "Patient": [row[2] for row in rows],
+            "Disease": [row[3] for row in rows],
+            "Diagnosis": [row[4] for row in rows],
+            "Risk": [row[5] for row in rows],
+        },
+        column_config={"Risk": st.column_config.ProgressColumn("Risk", min_value=0.0, max_value=1.0, format="percent")},
+        hide_index=True,
+    )
+
+@rerun_stats.fragment('doctor/analytics')
+def show_analytics(clinics=None):
+    # Cohort view read from each shard's trigger-maintained daily summary table, never from diagnoses
+    versions = get_store().versions(clinics)
+    summary = cached_summary(versions, clinics)
+    if not summary:
+        st.info("No diagnoses recorded yet.")
+        return
+    st.dataframe(
+        {
+            "Disease": [row[0] for row in summary],
+            "Diagnoses": [row[1] for row in summary],
+            "Positive": [row[2] for row in summary],
+            "Positive rate": [row[2] / row[1] for row in summary],
+            "Mean risk": [row[3] for row in summary],
+        },
+        column_config={
+            "Positive rate": st.column_config.NumberColumn(format="percent"),
+            "Mean risk": st.column_config.NumberColumn(format="percent"),
+        },
+        hide_index=True,
+    )
+
+    col1, col2 = st.columns(2)
+    days = col1.selectbox("Period", [30, 90, 365, 3650], format_func=lambda d: f"Last {d} days", key="trend_days")
+    metric = col2.radio("Trend", ["Diagnoses", "Positive rate"], horizontal=True, key="trend_metric")
+    since = (datetime.date.today() - datetime.timedelta(days=days)).isoformat()
+    trend = {}
+    for day, disease, total, positive in cached_trend(versions, clinics, since):
+        trend.setdefault(disease, {})[day] = total if metric == "Diagnoses" else positive / total
+    st.line_chart(trend)
+
+@rerun_stats.fragment('doctor/performance')
+def show_performance():
+    # Admin view of the latency metrics and the rerun profiler (see metrics.py)
+    collect = st.checkbox("Collect metrics", value=metrics.enabled, key="collect_metrics")
+    if collect and not metrics.enabled:
+        metrics.enable()
+    elif not collect and metrics.enabled:
+        metrics.disable()
 
-    # Fetch all patients from the database
-    cursor.execute("SELECT DISTINCT name FROM patient_data")
-    patient_names = [row[0] for row in cursor.fetchall()]
-    
-    if not patient_names:
+    rows = metrics.snapshot()
+    if rows:
+        st.dataframe(
+            {
+                "Metric": [row['metric'] for row in rows],
+                "Labels": [", ".join(f"{k}={v}" for k, v in row['labels'].items()) for row in rows],
+                "Calls": [row['count'] for row in rows],
+                "Errors": [row['errors'] for row in rows],
+                "Mean ms": [row['mean_seconds'] * 1000 for row in rows],
+                "p50 ms": [row['p50_seconds'] * 1000 for row in rows],
+                "p95 ms": [row['p95_seconds'] * 1000 for row in rows],
+                "p99 ms": [row['p99_seconds'] * 1000 for row in rows],
+            },
+            hide_index=True,
+        )
+    else:
+        st.info("No measurements yet.")
+
+    col1, col2 = st.columns(2)
+    col1.download_button("Download Prometheus metrics", data=metrics.prometheus_text(), file_name="metrics.prom",
+                         mime="text/plain")
+    if col2.button("Reset metrics"):
+        metrics.registry.reset()
+        rerun_stats.rerun()
+
+    # Full reruns against fragment-only reruns of this session (see rerun_stats.py)
+    st.markdown("**This session's reruns**")
+    rows = rerun_stats.readout()
+    st.dataframe(
+        {
+            "Scope": ["full app" if row[0] == 'app' else row[0] for row in rows],
+            "Reruns": [row[1] for row in rows],
+            "Mean ms": [row[2] for row in rows],
+            "Mean CPU ms": [row[3] for row in rows],
+            "Last ms": [row[4] for row in rows],
+            "Last CPU ms": [row[5] for row in rows],
+        },
+        hide_index=True,
+    )
+
+    # cProfile one slow rerun of any session
+    st.markdown("**Rerun profiler**")
+    if metrics.profiler_armed():
+        st.info("Waiting for a slow rerun to profile...")
+        if st.button("Cancel profiling"):
+            metrics.disarm_profiler()
+            rerun_stats.rerun()
+    else:
+        min_ms = st.number_input("Profile the next rerun slower than (ms)", min_value=0, value=500, step=100, key="profile_min_ms")
+        if st.button("Profile next slow rerun"):
+            metrics.arm_profiler(min_ms / 1000)
+            rerun_stats.rerun()
+    profile = metrics.last_profile
+    if profile:
+        st.caption(f"Rerun of the {profile['page']} page at {profile['captured_at']}, "
+                   f"{profile['seconds'] * 1000:.0f} ms")
+        st.code(profile['report'], language=None)
+
+@rerun_stats.fragment('doctor/patients')
+def show_patients(clinics=None):
+    store = get_store()
+
+    # Fetch one page of patients across the clinics' shards
+    search = st.text_input("Search patients by name")
+    patients = keyset_page(
+        f"patient_pages_{clinics}_{search}",
+        lambda after, limit: cached_patients(store.versions(clinics), clinics, search, after, limit),
+        lambda row: (row[2], row[0])
+    )
+
+    if not patients:
         st.warning("No patient data available.")
         return
 
-    # Select a patient
-    selected_patient = st.selectbox("Select a Patient", patient_names)
+    # Select a patient; the same name can exist in several clinics
+    many_clinics = clinics is None and len(store.clinics()) > 1
+    selected = st.selectbox("Select a Patient", patients,
+                            format_func=lambda row: f"{row[2]} ({row[0]})" if many_clinics else row[2])
 
-    if selected_patient:
-        # Fetch patient data for the selected patient
-        cursor.execute("SELECT disease, diagnosis FROM patient_data WHERE name = ?", (selected_patient,))
-        patient_records = cursor.fetchall()
+    if selected:
+        # Fetch patient data for the selected patient from their clinic's shard
+        clinic, patient_id, selected_patient = selected
+        patient_records = keyset_page(
+            f"record_pages_{clinic}_{patient_id}",
+            lambda after, limit: cached_records(store.versions([clinic]), clinic, patient_id, after, limit),
+            lambda row: row[0]
+        )
 
         if patient_records:
             st.subheader(f"Data for {selected_patient}")
             
-            # Display all records for the patient
-            for i, (disease, diagnosis) in enumerate(patient_records, start=1):
-                st.write(f"**Record {i}:**")
-                st.write(f"- **Disease:** {disease}")
-                st.write(f"- **Diagnosis:** {diagnosis}")
-                st.write("---")
-
-            # Allow doctor to add new recommendations
+            # Display the patient's history in one table
+            st.dataframe(
+                {
+                    "Record": [row[0] for row in patient_records],
+                    "Date": [row[1] for row in patient_records],
+                    "Disease": [row[2] for row in patient_records],
+                    "Diagnosis": [row[3] for row in patient_records],
+                    "Risk": [row[4] for row in patient_records],
+                },
+                column_config={"Risk": st.column_config.NumberColumn("Risk", format="percent")},
+                hide_index=True,
+            )
+            record_id, _, disease, diagnosis, _ = patient_records[-1]
+
+            show_top_factors(clinic, record_id)
+
+            # Allow doctor to add new recommendations; typing doesn't rerun until a button is pressed
             st.subheader("Add Recommendations")
-            new_recommendations = st.text_area("Enter your recommendations for the patient")
+            with st.form("recommendations"):
+                new_recommendations = st.text_area("Enter your recommendations for the patient")
+                col1, col2 = st.columns(2)
+                generate = col1.form_submit_button("Generate Report")
+                save = col2.form_submit_button("Save Recommendations")
 
-            # Generate Report Button
-            if st.button("Generate Report"):
+            # Generate Report Button (rendered in the background)
+            if generate:
                 patient_data = {
                     "Name": selected_patient,
                     "Disease": disease,
                     "Diagnosis": diagnosis
                 }
-                report_path = generate_pdf(patient_data, new_recommendations)
-                st.success("Report generated successfully!")
-                with open(report_path, "rb") as f:
-                    st.download_button(
-                        label="Download Report",
-                        data=f,
-                        file_name=f"{selected_patient}_report.pdf",
-                        mime="application/pdf"
-                    )
-
-            # Save Recommendations Button
-            if st.button("Save Recommendations"):
-                cursor.execute("""
-                    UPDATE patient_data 
-                    SET recommendations = ? 
-                    WHERE name = ? AND disease = ? AND diagnosis = ?""",
-                    (new_recommendations, selected_patient, disease, diagnosis)
-                )
-                conn.commit()
+                st.session_state.report_job = (get_report_service().submit(patient_data, new_recommendations),
+                                               selected_patient)
+
+            report_job = st.session_state.get('report_job')
+            if report_job and report_job[1] == selected_patient:
+                show_report_status(report_job[0], f"{selected_patient}_report.pdf")
+
+            # Save Recommendations Button; the write invalidates the clinic's cached listings
+            if save:
+                store.write(clinic, lambda conn: set_recommendations(conn, record_id, new_recommendations))
                 st.success("Recommendations saved successfully!")
 
+@rerun_stats.fragment('doctor/bulk_reports')
+def show_bulk_reports(clinics=None):
+    # Bulk report generation for every patient, rendered in parallel
+    st.subheader("Bulk Reports")
+    if st.button("Generate reports for all patients"):
+        # One report per patient listing all of their records
+        all_records = {}
+        shards = get_store().fan_out(lambda clinic, conn: conn.execute(
+            "SELECT name, disease, diagnosis FROM patient_data ORDER BY name, id").fetchall(), clinics)
+        for clinic, rows in shards.items():
+            for name, disease, diagnosis in rows:
+                records = all_records.setdefault((clinic, name), {"Name": name, "Clinic": clinic})
+                records[f"Record {len(records) - 1}"] = f"{disease} - {diagnosis}"
+        st.session_state.bulk_report_jobs = get_report_service().submit_bulk(
+            (records, "") for records in all_records.values()
+        )
+
+    bulk_jobs = st.session_state.get('bulk_report_jobs')
+    if bulk_jobs:
+        if reports_pending(bulk_jobs):
+            poll_bulk_reports(bulk_jobs)
+        else:
+            show_bulk_progress(bulk_jobs)
+            st.success(f"Reports saved to {reports_dir}")
+
+def show_bulk_progress(job_ids):
+    states = [get_report_service().status(job_id)[0] for job_id in job_ids]
+    done = states.count('done')
+    failed = states.count('failed')
+    st.progress(done / len(job_ids), text=f"{done} of {len(job_ids)} reports ready, {failed} failed")
+    return done + failed < len(job_ids)
+
+@rerun_stats.fragment('doctor/bulk_report_status', run_every=REPORT_POLL_SECONDS)
+def poll_bulk_reports(job_ids):
+    if not show_bulk_progress(job_ids):
+        st.rerun(scope='app')
+
+@rerun_stats.fragment('doctor/prediction_cache')
+def show_prediction_cache():
+    # Admin view of the prediction cache shared by all patient sessions
+    stats = prediction_cache.stats()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Hit rate", f"{stats['hit_rate']:.0%}")
+    col2.metric("Hits / misses", f"{stats['hits']} / {stats['misses']}")
+    col3.metric("Evictions", stats['evictions'] + stats['expirations'])
+    col4.metric("Entries", f"{stats['size']} / {stats['maxsize']}")
+    st.json(stats)
+    if st.button("Clear prediction cache"):
+        prediction_cache.clear()
+        rerun_stats.rerun()
+
+def doctor_dashboard():
+    st.title("Doctor's Dashboard")
+    # Changing the clinic filter reruns the whole page; every other control only reruns its own section
+    clinics = select_clinics()
+
+    with st.expander("Analytics", expanded=True):
+        show_analytics(clinics)
+
+    show_patients(clinics)
+    show_risk_ranking(clinics)
+    show_bulk_reports(clinics)
+
+    with st.expander("Prediction cache"):
+        show_prediction_cache()
+
+    with st.expander("Performance metrics"):
+        show_performance()
+
     # Logout button
     if st.button('Logout'):
         st.session_state.clear()  # Clear session state
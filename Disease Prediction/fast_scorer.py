@@ -0,0 +1,120 @@
+"""Compiled-coefficient scorers for the linear disease models.
+
+The heart model is a LogisticRegression and the diabetes and Parkinson's
+models are linear-kernel SVCs, so a prediction is one dot product plus a
+bias. compile_model() copies coef_/intercept_ into plain NumPy arrays and
+returns a scorer with the same predict/decision_function interface that skips
+scikit-learn's per-call validation. Any model that is not a binary linear
+classifier, or whose compiled scores do not match the original, is returned
+wrapped as-is so callers never see a different answer.
+
+Check parity against the saved models with:
+    python fast_scorer.py --check
+"""
+import argparse
+import sys
+
+import numpy as np
+
+from model_registry import MODEL_FILES, get_model
+
+
+class LinearScorer:
+    def __init__(self, coef, intercept, classes):
+        self.coef = np.ascontiguousarray(np.ravel(coef), dtype=np.float64)
+        self.intercept = float(np.ravel(intercept)[0])
+        self.classes_ = np.asarray(classes)
+        self.n_features_in_ = self.coef.shape[0]
+
+    def decision_function(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        return X @ self.coef + self.intercept
+
+    def predict(self, X):
+        return self.classes_[(self.decision_function(X) > 0).astype(np.intp)]
+
+
+class LogisticScorer(LinearScorer):
+    def predict_proba(self, X):
+        positive = 1.0 / (1.0 + np.exp(-self.decision_function(X)))
+        return np.column_stack([1.0 - positive, positive])
+
+
+class SklearnScorer:
+    # Fallback that keeps the original estimator for anything we can't compile
+    def __init__(self, model):
+        self.model = model
+        self.classes_ = model.classes_
+        self.n_features_in_ = model.n_features_in_
+        self.predict = model.predict
+        self.decision_function = model.decision_function
+        if hasattr(model, 'predict_proba'):
+            self.predict_proba = model.predict_proba
+
+
+def is_linear(model):
+    if not hasattr(model, 'intercept_') or len(getattr(model, 'classes_', ())) != 2:
+        return False
+    if hasattr(model, 'kernel'):
+        return model.kernel == 'linear'
+    return hasattr(model, 'coef_')
+
+
+def probe_rows(model, n_rows=256, seed=0):
+    # Rows to compare the compiled scorer against: the SVC's own support
+    # vectors (which sit on the decision boundary) plus random rows
+    rng = np.random.default_rng(seed)
+    rows = [rng.normal(scale=100.0, size=(n_rows, model.n_features_in_))]
+    if hasattr(model, 'support_vectors_'):
+        rows.append(np.asarray(model.support_vectors_, dtype=np.float64))
+    return np.vstack(rows)
+
+
+def check_parity(model, scorer, X=None):
+    # Returns (label mismatches, max absolute difference in decision scores)
+    if X is None:
+        X = probe_rows(model)
+    mismatches = int(np.count_nonzero(model.predict(X) != scorer.predict(X)))
+    max_diff = float(np.max(np.abs(model.decision_function(X) - scorer.decision_function(X))))
+    return mismatches, max_diff
+
+
+def compile_model(model, verify=True):
+    if not is_linear(model):
+        return SklearnScorer(model)
+
+    scorer_class = LogisticScorer if hasattr(model, 'predict_proba') else LinearScorer
+    scorer = scorer_class(model.coef_, model.intercept_, model.classes_)
+    if verify:
+        mismatches, max_diff = check_parity(model, scorer)
+        if mismatches or max_diff > 1e-6:
+            return SklearnScorer(model)
+    return scorer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile the saved models and check parity with scikit-learn.")
+    parser.add_argument('--check', action='store_true', help="Compare compiled and original predictions")
+    parser.add_argument('--rows', type=int, default=10000, help="Random rows per model for --check")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for key in MODEL_FILES:
+        model = get_model(key)
+        scorer = compile_model(model, verify=False)
+        kind = type(scorer).__name__
+        if not args.check:
+            print(f"{key}: {kind}")
+            continue
+        if isinstance(scorer, SklearnScorer):
+            print(f"{key}: {kind} (not compiled, uses scikit-learn)")
+            continue
+        mismatches, max_diff = check_parity(model, scorer, probe_rows(model, args.rows))
+        status = 'OK' if mismatches == 0 and max_diff <= 1e-6 else 'FAILED'
+        failed = failed or status == 'FAILED'
+        print(f"{key}: {kind} {status} - {mismatches} label mismatches, max score difference {max_diff:.2e}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""Declarative input schemas for the disease models.
+
+Each disease lists its model features in order with their dtype and valid
+range. The list drives everything that turns patient inputs into model
+inputs:
+
+  * to_array() validates and converts a whole batch (a DataFrame, dict of
+    columns or sequence of rows) into one contiguous float64 array.
+    check_rows() does the same but marks invalid values instead of raising,
+    so batch jobs can skip the rows they are in.
+  * render_widgets() builds the patient page's Streamlit inputs.
+  * check_model() confirms a loaded model expects exactly these features.
+
+Run this module to check every saved model against its schema:
+
+    python feature_schema.py
+"""
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+# dtype is 'int', 'float' or 'category'. Categories list their allowed values,
+# or map display labels to values (heart `sex`: Male -> 1, Female -> 0).
+# min/max are inclusive and None means unbounded; they cover every value the
+# model was trained on. default, step, format and widget_max only affect the
+# Streamlit widget, where widget_max can keep the patient page to a narrower
+# range than the one batches are validated against.
+Feature = namedtuple('Feature', ['name', 'label', 'dtype', 'min', 'max', 'choices', 'default', 'step', 'format',
+                                 'widget_max'],
+                     defaults=[None, None, None, None, None, None, None, None])
+
+
+def _int(name, label, min=0, max=None, widget_max=None):
+    return Feature(name, label, 'int', min, max, step=1, widget_max=widget_max)
+
+
+def _float(name, label, min=None, max=None, default=None, step=None, format=None):
+    return Feature(name, label, 'float', min, max, default=default, step=step, format=format)
+
+
+def _category(name, label, choices):
+    values = list(choices.values()) if isinstance(choices, dict) else list(choices)
+    return Feature(name, label, 'category', min(values), max(values), choices)
+
+
+def category_values(feature):
+    # The numeric values a category feature accepts
+    return list(feature.choices.values()) if isinstance(feature.choices, dict) else list(feature.choices)
+
+
+SCHEMAS = {
+    'diabetes': [
+        _int('Pregnancies', 'Number of Pregnancies'),
+        _int('Glucose', 'Glucose Level'),
+        _int('BloodPressure', 'Blood Pressure'),
+        _int('SkinThickness', 'Skin Thickness'),
+        _int('Insulin', 'Insulin Level'),
+        _float('BMI', 'BMI', min=0.0, step=0.1),
+        _float('DiabetesPedigreeFunction', 'Diabetes Pedigree Function', default=0.078, step=0.001,
+               format='%.3f'),
+        _int('Age', 'Age', min=1),
+    ],
+    'heart': [
+        _int('age', 'Age', min=1),
+        _category('sex', 'Sex', {'Male': 1, 'Female': 0}),
+        _category('cp', 'Chest Pain Type', [0, 1, 2, 3]),
+        _int('trestbps', 'Resting Blood Pressure'),
+        _int('chol', 'Cholesterol'),
+        _category('fbs', 'Fasting Blood Sugar > 120 mg/dl', [0, 1]),
+        _category('restecg', 'Resting Electrocardiographic Results', [0, 1, 2]),
+        _int('thalach', 'Maximum Heart Rate Achieved'),
+        _category('exang', 'Exercise Induced Angina', [0, 1]),
+        _float('oldpeak', 'Oldpeak', min=0.0, step=0.1),
+        _category('slope', 'Slope of the Peak Exercise ST Segment', [0, 1, 2]),
+        # The training data also codes ca as 4, so batches may contain it; the page offers 0-3
+        _int('ca', 'Number of Major Vessels (0-3)', max=4, widget_max=3),
+        _category('thal', 'Thalassemia', [0, 1, 2, 3]),
+    ],
+    # Ranges are those of the UCI Parkinson's dataset the model was trained on
+    'parkinsons': [
+        _float('MDVP:Fo(Hz)', 'MDVP:Fo(Hz)', 88.333, 260.105, 100.0),
+        _float('MDVP:Fhi(Hz)', 'MDVP:Fhi(Hz)', 102.145, 592.03, 150.0),
+        _float('MDVP:Flo(Hz)', 'MDVP:Flo(Hz)', 65.476, 239.17, 70.0),
+        _float('MDVP:Jitter(%)', 'MDVP:Jitter(%)', 0.00168, 0.03316, 0.02, format='%.5f'),
+        _float('MDVP:Jitter(Abs)', 'MDVP:Jitter(Abs)', 0.000007, 0.00026, 0.0001, format='%.6f'),
+        _float('MDVP:RAP', 'MDVP:RAP', 0.00068, 0.02144, 0.001, format='%.5f'),
+        _float('MDVP:PPQ', 'MDVP:PPQ', 0.00092, 0.01958, 0.001, format='%.5f'),
+        _float('Jitter:DDP', 'Jitter:DDP', 0.00204, 0.06433, 0.01, format='%.5f'),
+        _float('MDVP:Shimmer', 'MDVP:Shimmer', 0.00954, 0.11908, 0.01, format='%.5f'),
+        _float('MDVP:Shimmer(dB)', 'MDVP:Shimmer(dB)', 0.085, 1.302, 0.1, format='%.3f'),
+        _float('Shimmer:APQ3', 'Shimmer:APQ3', 0.00455, 0.05647, 0.01, format='%.5f'),
+        _float('Shimmer:APQ5', 'Shimmer:APQ5', 0.0057, 0.0794, 0.01, format='%.5f'),
+        _float('MDVP:APQ', 'MDVP:APQ', 0.00719, 0.13778, 0.01, format='%.5f'),
+        _float('Shimmer:DDA', 'Shimmer:DDA', 0.01364, 0.16942, 0.015, format='%.5f'),
+        _float('NHR', 'NHR', 0.00065, 0.31482, 0.01, format='%.5f'),
+        _float('HNR', 'HNR', 8.441, 33.047, 10.0, format='%.3f'),
+        _float('RPDE', 'RPDE', 0.25657, 0.685151, 0.5, format='%.6f'),
+        _float('DFA', 'DFA', 0.574282, 0.825288, 0.6, format='%.6f'),
+        _float('spread1', 'spread1', -7.964984, -2.434031, -5.0, format='%.6f'),
+        _float('spread2', 'spread2', 0.006274, 0.450493, 0.1, format='%.6f'),
+        _float('D2', 'D2', 1.423287, 3.671155, 2.0, format='%.6f'),
+        _float('PPE', 'PPE', 0.044539, 0.527367, 0.1, format='%.6f'),
+    ],
+}
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def feature_names(key):
+    return [feature.name for feature in SCHEMAS[key]]
+
+
+class _Compiled:
+    # Per-disease arrays used by the vectorized checks
+    def __init__(self, features):
+        self.mins = np.array([-np.inf if f.min is None else f.min for f in features], dtype=np.float64)
+        self.maxs = np.array([np.inf if f.max is None else f.max for f in features], dtype=np.float64)
+        self.integral = np.array([f.dtype != 'float' for f in features])
+        self.categories = [(i, np.array(category_values(f), dtype=np.float64))
+                           for i, f in enumerate(features) if f.dtype == 'category']
+        self.labels = {f.name: {str(label).lower(): value for label, value in f.choices.items()}
+                       for f in features if isinstance(f.choices, dict)}
+
+
+_compiled = {key: _Compiled(features) for key, features in SCHEMAS.items()}
+
+
+def _columns_to_array(key, columns):
+    # DataFrame or {name: values}: select the model's columns in order, mapping labelled categories
+    import pandas as pd
+
+    frame = columns if isinstance(columns, pd.DataFrame) else pd.DataFrame(columns)
+    names = feature_names(key)
+    missing = [name for name in names if name not in frame.columns]
+    if missing:
+        raise SchemaError(f"Input is missing columns: {', '.join(missing)}")
+    frame = frame[names]
+    for name, labels in _compiled[key].labels.items():
+        if not pd.api.types.is_numeric_dtype(frame[name]):
+            # e.g. the dashboard's Male/Female next to the training data's 1/0; unknown labels become NaN
+            mapping = {**labels, **{str(value): value for value in labels.values()}}
+            frame = frame.assign(**{name: frame[name].astype(str).str.strip().str.lower().map(mapping)})
+    try:
+        return frame.to_numpy(dtype=np.float64)
+    except (TypeError, ValueError):
+        # Text in a numeric column is an invalid value of that row, like a missing one
+        return frame.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+
+
+def check_rows(key, data):
+    # Converts a batch like to_array() and returns (X, bad), where bad[i, j] marks an invalid value.
+    # Only a batch with the wrong columns or shape raises SchemaError.
+    if hasattr(data, 'columns') or isinstance(data, dict):
+        X = _columns_to_array(key, data)
+    else:
+        try:
+            X = np.array(data, dtype=np.float64, ndmin=2)
+        except (TypeError, ValueError):
+            raise SchemaError("Features must be numbers")
+    features = SCHEMAS[key]
+    if X.ndim != 2 or X.shape[1] != len(features):
+        raise SchemaError(f"Expected {len(features)} features per row, got shape {X.shape}")
+
+    compiled = _compiled[key]
+    bad = ~np.isfinite(X) | (X < compiled.mins) | (X > compiled.maxs)
+    bad[:, compiled.integral] |= X[:, compiled.integral] != np.round(X[:, compiled.integral])
+    for i, allowed in compiled.categories:
+        bad[:, i] |= ~np.isin(X[:, i], allowed)
+    return X, bad
+
+
+def to_array(key, data):
+    # Validates a batch and returns it as a C-contiguous float64 array of shape (rows, features)
+    X, bad = check_rows(key, data)
+    if bad.any():
+        raise SchemaError(describe_invalid(key, X, bad))
+    return np.ascontiguousarray(X)
+
+
+def describe_invalid(key, X, bad, first_row=0):
+    # One line per offending feature: how many rows, the first bad value and the valid range.
+    # Rows are numbered from first_row, e.g. a chunk's offset in its file.
+    problems = []
+    for i in np.flatnonzero(bad.any(axis=0)):
+        feature = SCHEMAS[key][i]
+        rows = np.flatnonzero(bad[:, i])
+        if feature.dtype == 'category':
+            allowed = f"one of {feature.choices}"
+        else:
+            allowed = f"{feature.dtype} in [{feature.min if feature.min is not None else '-inf'}, " \
+                      f"{feature.max if feature.max is not None else 'inf'}]"
+        value = X[rows[0], i]
+        problems.append(f"'{feature.name}' must be {allowed}: {len(rows)} row(s), first is row "
+                        f"{rows[0] + first_row} with {'a missing or non-numeric value' if np.isnan(value) else f'{value:g}'}")
+    return "Invalid input: " + "; ".join(problems)
+
+
+def check_model(key, model):
+    # Raises SchemaError if the model was not trained on this disease's features
+    expected = feature_names(key)
+    n_features = getattr(model, 'n_features_in_', None)
+    if n_features is not None and n_features != len(expected):
+        raise SchemaError(f"The {key} model expects {n_features} features but its schema has {len(expected)}")
+    trained_on = getattr(model, 'feature_names_in_', None)
+    if trained_on is not None and list(trained_on) != expected:
+        raise SchemaError(f"The {key} model was trained on columns {list(trained_on)}, expected {expected}")
+
+
+def render_widgets(key, columns):
+    # Draws one input per feature across `columns` (e.g. st.columns(3)) and returns the model-ready row
+    row = []
+    for i, feature in enumerate(SCHEMAS[key]):
+        col = columns[i % len(columns)]
+        widget_key = f"{key}_{feature.name}"
+        if feature.dtype == 'category':
+            options = list(feature.choices)
+            choice = col.selectbox(feature.label, options=options, key=widget_key)
+            row.append(feature.choices[choice] if isinstance(feature.choices, dict) else choice)
+        elif feature.dtype == 'int':
+            max_value = feature.widget_max if feature.widget_max is not None else feature.max
+            row.append(col.number_input(feature.label, min_value=feature.min, max_value=max_value,
+                                        value=feature.default if feature.default is not None else feature.min,
+                                        step=1, key=widget_key))
+        else:
+            value = next((v for v in (feature.default, feature.min, 0.0) if v is not None))
+            row.append(col.number_input(feature.label, min_value=feature.min, max_value=feature.max,
+                                        value=float(value), step=feature.step, format=feature.format,
+                                        key=widget_key))
+    return row
+
+
+def random_rows(key, n, seed=0):
+    # Valid random inputs (unbounded features stay within 100 of their minimum), e.g. for load tests
+    rng = np.random.default_rng(seed)
+    columns = []
+    for feature in SCHEMAS[key]:
+        if feature.dtype == 'category':
+            columns.append(rng.choice(np.array(category_values(feature), dtype=np.float64), size=n))
+            continue
+        low = feature.min if feature.min is not None else 0.0
+        high = feature.max if feature.max is not None else low + 100
+        values = rng.uniform(low, high, size=n)
+        columns.append(np.round(values) if feature.dtype == 'int' else values)
+    return np.ascontiguousarray(np.column_stack(columns))
+
+
+def main():
+    from model_registry import get_model
+
+    failed = False
+    for key, features in SCHEMAS.items():
+        try:
+            check_model(key, get_model(key))
+            print(f"{key}: {len(features)} features, model OK")
+        except SchemaError as e:
+            print(f"{key}: {e}", file=sys.stderr)
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,355 @@
+"""Versioned inference pipelines: preprocessing fused with the model.
+
+A pipeline artifact bundles a model with its optional StandardScaler. For
+linear models the scaler is folded into the coefficients,
+
+    w' = w / scale        b' = b - w' . mean
+
+so predicting from raw features stays a single dot product with no separate
+transform pass. Nonlinear models keep the scaler and apply it before predict.
+
+Build the artifacts with
+
+    python inference_pipeline.py build diabetes --scaler saved_models/diabetes_scaler.sav
+
+(the last cell of diabetes_.ipynb saves the model, its scaler and the
+fused pipeline). The diabetes_model.sav currently in saved_models/ was
+fitted on the unscaled DataFrame, not on the notebook's standardized array.
+It matches the notebook's example prediction on raw input, so it is built
+without a scaler. If no artifact at least as new as the .sav exists,
+get_pipeline() builds one in memory from the .sav, fusing
+saved_models/<model>_scaler.sav when that was saved with or after the model
+(train.py publishes models that take raw features, which an older scaler
+does not belong to). Pipelines are rebuilt when their files change on disk.
+
+InferencePipeline.score(X) returns labels, decision values, positive-class
+probabilities and, for linear models, per-feature contributions for a whole
+batch. The SVC models have no probability output of their own, so the
+artifact can carry a Platt calibration, P(positive) = sigmoid(a * f + b),
+fitted on labelled data that the model was not trained on:
+
+    python inference_pipeline.py build parkinsons --calibrate holdout.csv
+
+Without one, logistic regression uses its own probabilities and the SVCs
+have no risk: score() returns risk None for them, so only their decision
+value is stored and they stay out of the doctor's risk ranking.
+probability() still falls back to sigmoid(f), which ranks one model's
+patients correctly but is not a probability.
+"""
+import argparse
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+import numpy as np
+
+from diseases import DISEASES
+from feature_schema import check_model, to_array
+from fast_scorer import LinearScorer, LogisticScorer, check_parity, is_linear, probe_rows
+from metrics import timer
+from model_registry import MODEL_FILES, file_signature, get_model, model_path, model_signature, models_dir
+
+# Bump when the layout of the artifact dictionary changes
+FORMAT_VERSION = 1
+
+
+def pipeline_path(key):
+    return f"{models_dir}/{key}_pipeline.joblib"
+
+
+def scaler_path(key):
+    return f"{models_dir}/{key}_scaler.sav"
+
+
+def sigmoid(x):
+    # Numerically stable logistic function
+    x = np.asarray(x, dtype=np.float64)
+    e = np.exp(-np.abs(x))
+    return np.where(x >= 0, 1.0 / (1.0 + e), e / (1.0 + e))
+
+
+def fit_calibration(decision, y):
+    # Platt scaling: fit P(y = 1 | f) = sigmoid(a * f + b) to held-out decision values
+    from sklearn.linear_model import LogisticRegression
+
+    calibrator = LogisticRegression(C=1e6).fit(np.asarray(decision, dtype=np.float64).reshape(-1, 1), np.asarray(y))
+    return float(calibrator.coef_[0, 0]), float(calibrator.intercept_[0])
+
+
+def fuse_scaler(coef, intercept, mean, scale):
+    coef = np.ravel(coef).astype(np.float64)
+    fused_coef = coef / scale
+    fused_intercept = float(np.ravel(intercept)[0]) - float(fused_coef @ mean)
+    return fused_coef, fused_intercept
+
+
+def build_pipeline(key, scaler=None, model=None, calibration=None):
+    if model is None:
+        model = get_model(key)
+    mean = scale = None
+    if scaler is not None:
+        mean = np.asarray(scaler.mean_, dtype=np.float64) if scaler.with_mean else np.zeros(scaler.n_features_in_)
+        scale = np.asarray(scaler.scale_, dtype=np.float64) if scaler.with_std else np.ones(scaler.n_features_in_)
+        if mean.shape[0] != model.n_features_in_:
+            raise ValueError(f"Scaler has {mean.shape[0]} features but the {key} model expects {model.n_features_in_}")
+
+    # The version identifies the exact model and preprocessing
+    digest = hashlib.sha256(pickle.dumps(model))
+    if mean is not None:
+        digest.update(mean.tobytes())
+        digest.update(scale.tobytes())
+    if calibration is not None:
+        digest.update(np.asarray(calibration, dtype=np.float64).tobytes())
+
+    artifact = {
+        'format_version': FORMAT_VERSION,
+        'disease': key,
+        'version': digest.hexdigest()[:12],
+        'model': model,
+        'mean': mean,
+        'scale': scale,
+        'coef': None,
+        'intercept': None,
+        'calibration': calibration,
+    }
+    if is_linear(model):
+        if mean is None:
+            artifact['coef'] = np.ravel(model.coef_).astype(np.float64)
+            artifact['intercept'] = float(np.ravel(model.intercept_)[0])
+        else:
+            artifact['coef'], artifact['intercept'] = fuse_scaler(model.coef_, model.intercept_, mean, scale)
+    return artifact
+
+
+def save_pipeline(artifact, path=None):
+    import joblib
+
+    path = path or pipeline_path(artifact['disease'])
+    tmp_path = f"{path}.tmp"
+    joblib.dump(artifact, tmp_path, compress=0)
+    os.replace(tmp_path, path)
+    return path
+
+
+class InferencePipeline:
+    def __init__(self, artifact):
+        if artifact.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported pipeline format {artifact.get('format_version')}")
+        self.disease = artifact['disease']
+        self.version = artifact['version']
+        self.model = artifact['model']
+        # Refuse to serve a model trained on different inputs than the app collects
+        check_model(self.disease, self.model)
+        self.mean = artifact['mean']
+        self.scale = artifact['scale']
+        self.classes_ = self.model.classes_
+        self.n_features_in_ = self.model.n_features_in_
+        self.calibration = artifact.get('calibration')
+        self.calibrated = self.calibration is not None or hasattr(self.model, 'predict_proba')
+        self.coef = artifact['coef']
+        self.intercept = artifact['intercept']
+
+        self.scorer = None
+        if artifact['coef'] is not None:
+            scorer_class = LogisticScorer if hasattr(self.model, 'predict_proba') else LinearScorer
+            scorer = scorer_class(artifact['coef'], artifact['intercept'], self.classes_)
+            # Only use the fused scorer if it agrees with scaler + model
+            X = probe_rows(self.model)
+            reference = _Reference(self)
+            mismatches, max_diff = check_parity(reference, scorer, X)
+            if mismatches == 0 and max_diff <= 1e-6:
+                self.scorer = scorer
+
+        if self.scorer is not None:
+            self.decision_function = self.scorer.decision_function
+            self.predict = self.scorer.predict
+            if hasattr(self.scorer, 'predict_proba'):
+                self.predict_proba = self.scorer.predict_proba
+        elif hasattr(self.model, 'predict_proba'):
+            self.predict_proba = lambda X: self.model.predict_proba(self.transform(X))
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if self.mean is None:
+            return X
+        return (X - self.mean) / self.scale
+
+    def decision_function(self, X):
+        return self.model.decision_function(self.transform(X))
+
+    def predict(self, X):
+        return self.model.predict(self.transform(X))
+
+    def probability(self, X, decision=None):
+        # Positive-class probability; see the module docstring for how it is calibrated
+        if decision is None:
+            decision = self.decision_function(X)
+        if self.calibration is not None:
+            a, b = self.calibration
+            return sigmoid(a * decision + b)
+        if hasattr(self, 'predict_proba'):
+            if self.scorer is not None:
+                # The fused logistic scorer's probability is sigmoid(decision)
+                return sigmoid(decision)
+            return self.predict_proba(X)[:, 1]
+        return sigmoid(decision)
+
+    def contributions(self, X):
+        # Per-feature terms of the decision value for linear models, measured from
+        # the training mean when there is a scaler (otherwise from zero)
+        if self.coef is None:
+            return None
+        X = np.asarray(X, dtype=np.float64)
+        if self.mean is None:
+            return X * self.coef
+        return (X - self.mean) * self.coef
+
+    def score(self, X):
+        # Everything the app stores for a batch of rows, in one vectorized pass per output
+        with timer('model_seconds', model=self.disease, method='score'):
+            X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+            decision = np.ravel(self.decision_function(X))
+            if self.scorer is not None:
+                prediction = self.classes_[(decision > 0).astype(np.intp)]
+            else:
+                prediction = self.predict(X)
+            return {
+                'prediction': prediction,
+                'score': decision,
+                # Only calibrated models' risks are probabilities that can be compared across models
+                'risk': self.probability(X, decision) if self.calibrated else None,
+                'contributions': self.contributions(X),
+                'calibrated': self.calibrated,
+            }
+
+
+class _Reference:
+    # Unfused scaler + scikit-learn model, used for the parity check
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+
+    def predict(self, X):
+        return self.pipeline.model.predict(self.pipeline.transform(X))
+
+    def decision_function(self, X):
+        return self.pipeline.model.decision_function(self.pipeline.transform(X))
+
+
+def load_pipeline(key):
+    path = pipeline_path(key)
+    model_mtime = os.path.getmtime(model_path(key))
+    if os.path.exists(path) and os.path.getmtime(path) >= model_mtime:
+        import joblib
+        return InferencePipeline(joblib.load(path, mmap_mode='r'))
+    # A model trained on standardized features must never score raw inputs
+    scaler = None
+    if os.path.exists(scaler_path(key)) and os.path.getmtime(scaler_path(key)) >= model_mtime:
+        with open(scaler_path(key), 'rb') as f:
+            scaler = pickle.load(f)
+    return InferencePipeline(build_pipeline(key, scaler))
+
+
+# How often get_pipeline() checks the model files for changes, in seconds
+RELOAD_CHECK_INTERVAL = 1.0
+
+_pipelines = {}
+_lock = threading.Lock()
+
+
+def pipeline_signature(key):
+    return model_signature(key) + file_signature(pipeline_path(key)) + file_signature(scaler_path(key))
+
+
+def get_pipeline(key):
+    # Returns the cached pipeline, reloading it when the files behind it change
+    entry = _pipelines.get(key)
+    now = time.monotonic()
+    if entry is not None and now - entry[2] < RELOAD_CHECK_INTERVAL:
+        return entry[0]
+
+    signature = pipeline_signature(key)
+    if entry is None or entry[1] != signature:
+        with _lock:
+            entry = _pipelines.get(key)
+            if entry is None or entry[1] != signature:
+                entry = (load_pipeline(key), signature, now)
+                _pipelines[key] = entry
+                return entry[0]
+    _pipelines[key] = (entry[0], entry[1], now)
+    return entry[0]
+
+
+def load_labelled(key, path):
+    # Features and 0/1 labels from a CSV or Parquet file with the training dataset's columns
+    from batch_predict import read_chunks
+
+    label = DISEASES[key]['label']
+    features, labels = [], []
+    for chunk in read_chunks(path, 100000):
+        if label not in chunk.columns:
+            raise ValueError(f"{path} has no '{label}' label column")
+        features.append(to_array(key, chunk))
+        labels.append(chunk[label].to_numpy())
+    return np.concatenate(features), np.concatenate(labels)
+
+
+def calibrate(artifact, path):
+    # Fits a Platt calibration for `artifact` on the labelled rows in `path`
+    X, y = load_labelled(artifact['disease'], path)
+    pipeline = InferencePipeline(artifact)
+    decision = pipeline.decision_function(X)
+    positive = y == pipeline.classes_[1]
+    calibration = fit_calibration(decision, positive)
+    before = float(np.mean((pipeline.probability(X, decision) - positive) ** 2))
+    after = float(np.mean((sigmoid(calibration[0] * decision + calibration[1]) - positive) ** 2))
+    print(f"{artifact['disease']}: calibration a={calibration[0]:.4g} b={calibration[1]:.4g} on {len(y)} rows, "
+          f"Brier score {before:.4f} -> {after:.4f}")
+    return calibration
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build versioned inference pipeline artifacts.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build', help="Bundle a model (and optional scaler) into a pipeline artifact")
+    build.add_argument('models', nargs='*', help=f"Models to build (default: all of {', '.join(MODEL_FILES)})")
+    build.add_argument('--scaler', help="Pickled StandardScaler to fuse into the model (needs exactly one model)")
+    build.add_argument('--calibrate', metavar='DATA',
+                       help="Labelled held-out CSV/Parquet file to fit probability calibration on (needs exactly one model)")
+    subparsers.add_parser('show', help="Print the pipeline version used for each model")
+    args = parser.parse_args(argv)
+
+    if args.command == 'show':
+        for key in MODEL_FILES:
+            pipeline = load_pipeline(key)
+            kind = 'fused' if pipeline.scorer is not None else 'scikit-learn'
+            scaled = 'scaled' if pipeline.mean is not None else 'unscaled'
+            calibrated = 'calibrated' if pipeline.calibrated else 'uncalibrated'
+            print(f"{key}: version {pipeline.version} ({kind}, {scaled}, {calibrated})")
+        return
+
+    keys = args.models or list(MODEL_FILES)
+    unknown = [key for key in keys if key not in MODEL_FILES]
+    if unknown:
+        parser.error(f"Unknown model(s): {', '.join(unknown)}")
+    if args.scaler and len(keys) != 1:
+        parser.error("--scaler can only be used when building a single model")
+    if args.calibrate and len(keys) != 1:
+        parser.error("--calibrate can only be used when building a single model")
+
+    scaler = None
+    if args.scaler:
+        with open(args.scaler, 'rb') as f:
+            scaler = pickle.load(f)
+    for key in keys:
+        artifact = build_pipeline(key, scaler)
+        if args.calibrate:
+            artifact = build_pipeline(key, scaler, calibration=calibrate(artifact, args.calibrate))
+        if artifact['coef'] is not None and InferencePipeline(artifact).scorer is None:
+            print(f"Warning: fused {key} scorer does not match scikit-learn, predictions will use the model directly")
+        print(f"Saved {save_pipeline(artifact)} (version {artifact['version']})")
+
+
+if __name__ == '__main__':
+    main()
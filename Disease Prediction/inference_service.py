@@ -0,0 +1,304 @@
+"""HTTP inference service for the disease models.
+
+Exposes POST /predict/diabetes, /predict/heart and /predict/parkinsons (plus
+GET /health) as a plain ASGI application, `app`. Each request body is
+
+    {"features": [...]}
+
+with the features in the order given by feature_schema.py (for heart
+disease, sex is 1 for male and 0 for female). Values outside a feature's
+valid range are rejected with 400. Concurrent requests for
+the same model are collected for a few milliseconds by an asyncio
+micro-batcher and scored with one vectorized predict call.
+
+GET /metrics returns latency histograms in the Prometheus text format once
+metrics are enabled (--metrics or DISEASE_PREDICTION_METRICS=1, see
+metrics.py).
+
+Run it with the built-in server (standard library only):
+
+    python inference_service.py --port 8000
+
+or with any ASGI server, e.g. `uvicorn inference_service:app`.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from diseases import DISEASES
+from feature_schema import to_array
+from inference_pipeline import get_pipeline
+import metrics
+from metrics import timer
+
+
+class MicroBatcher:
+    def __init__(self, disease, max_batch=256, max_wait=0.002):
+        self.disease = disease
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = asyncio.Queue()
+        self._task = None
+        self.batches = 0
+        self.rows = 0
+
+    async def predict(self, features):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((features, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Take whatever else is already waiting without sleeping again
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                pipeline = get_pipeline(self.disease)
+                X = np.array([features for features, _ in batch], dtype=np.float64)
+                with timer('model_seconds', model=self.disease, method='predict'):
+                    if pipeline.scorer is not None:
+                        # Fused linear scoring takes microseconds, no need for a thread
+                        predictions = pipeline.predict(X)
+                    else:
+                        predictions = await asyncio.get_running_loop().run_in_executor(None, pipeline.predict, X)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.rows += len(batch)
+            for (_, future), prediction in zip(batch, predictions.tolist()):
+                if not future.done():
+                    future.set_result((prediction, pipeline.version))
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'rows': self.rows,
+            'mean_batch_size': self.rows / self.batches if self.batches else 0.0,
+        }
+
+
+# Micro-batching window; longer waits give bigger batches at the cost of latency
+MAX_WAIT = 0.002
+
+_batchers = {}
+
+
+def get_batcher(disease):
+    batcher = _batchers.get(disease)
+    if batcher is None:
+        batcher = _batchers[disease] = MicroBatcher(disease, max_wait=MAX_WAIT)
+    return batcher
+
+
+def parse_features(disease, body):
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise ValueError("Request body must be JSON")
+    features = payload.get('features') if isinstance(payload, dict) else None
+    expected = len(DISEASES[disease]['features'])
+    if not isinstance(features, list) or len(features) != expected:
+        raise ValueError(f"'features' must be a list of {expected} numbers")
+    if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in features):
+        raise ValueError("'features' must only contain numbers")
+    # SchemaError is a ValueError, so out-of-range values are a 400 too
+    return to_array(disease, [features])[0].tolist()
+
+
+async def predict(disease, body):
+    features = parse_features(disease, body)
+    prediction, version = await get_batcher(disease).predict(features)
+    negative, positive = DISEASES[disease]['diagnosis']
+    return {
+        'disease': DISEASES[disease]['disease'],
+        'prediction': prediction,
+        'diagnosis': positive if prediction == 1 else negative,
+        'model_version': version,
+    }
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _send_text(send, status, text, content_type=b'text/plain; version=0.0.4; charset=utf-8'):
+    body = text.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Load the models before the first request arrives
+                for disease in DISEASES:
+                    get_pipeline(disease)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    path = scope['path'].rstrip('/')
+    method = scope['method']
+    if path == '/health' and method == 'GET':
+        batchers = {disease: batcher.stats() for disease, batcher in _batchers.items()}
+        return await _send_json(send, 200, {'status': 'ok', 'batchers': batchers})
+    if path == '/metrics' and method == 'GET':
+        return await _send_text(send, 200, metrics.prometheus_text())
+
+    if path.startswith('/predict/'):
+        disease = path[len('/predict/'):]
+        if disease not in DISEASES:
+            return await _send_json(send, 404, {'error': f"Unknown model '{disease}'"})
+        if method != 'POST':
+            return await _send_json(send, 405, {'error': "Use POST"})
+        body = await _read_body(receive)
+        try:
+            with timer('http_request_seconds', model=disease):
+                result = await predict(disease, body)
+        except ValueError as e:
+            return await _send_json(send, 400, {'error': str(e)})
+        except Exception as e:
+            return await _send_json(send, 500, {'error': f"Prediction error: {e}"})
+        return await _send_json(send, 200, result)
+
+    return await _send_json(send, 404, {'error': 'Not found'})
+
+
+# Minimal HTTP/1.1 server so the service runs without an ASGI server installed
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+MAX_BODY = 1024 * 1024
+
+
+async def _handle_connection(reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, version = request_line.decode('latin-1').rstrip('\r\n').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY:
+                writer.write(b'HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            body = await reader.readexactly(length) if length else b''
+            keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+
+            received = False
+
+            async def receive():
+                nonlocal received
+                if received:
+                    return {'type': 'http.disconnect'}
+                received = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            response = []
+
+            async def send(message):
+                response.append(message)
+
+            scope = {'type': 'http', 'method': method, 'path': target.split('?', 1)[0],
+                     'headers': [(k.encode(), v.encode()) for k, v in headers.items()]}
+            await app(scope, receive, send)
+
+            start, body_message = response[0], response[1]
+            status = start['status']
+            head = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+            head += [f"{k.decode()}: {v.decode()}" for k, v in start['headers']]
+            head.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body_message['body'])
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host='127.0.0.1', port=8000):
+    for disease in DISEASES:
+        get_pipeline(disease)
+    server = await asyncio.start_server(_handle_connection, host, port, backlog=1024)
+    print(f"Serving predictions on http://{host}:{port}/predict/<{'|'.join(DISEASES)}>")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    global MAX_WAIT
+    parser = argparse.ArgumentParser(description="Serve the disease models over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT * 1000,
+                        help="How long to collect concurrent requests into one batch")
+    parser.add_argument('--metrics', action='store_true', help="Collect latency metrics, served on GET /metrics")
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        metrics.enable()
+
+    MAX_WAIT = args.max_wait_ms / 1000
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -1,53 +1,11 @@
-import sqlite3
 import streamlit as st
-import hashlib
-
-
-from patient_dashboard import patient_page
-from doctor_dashboard import doctor_dashboard
-
-# Database setup
-conn = sqlite3.connect('main_app.db', check_same_thread=False)
-c = conn.cursor()
-c.execute('''
-CREATE TABLE IF NOT EXISTS users (
-    first_name TEXT,
-    last_name TEXT,
-    phone_number TEXT,
-    email TEXT PRIMARY KEY,
-    password TEXT,
-    role TEXT
-)
-''')
-conn.commit()
-
-# Utility functions
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def register_user(first_name, last_name, phone_number, email, password, role):
-    c.execute("SELECT * FROM users WHERE email=?", (email,))
-    if c.fetchone():
-        return "Email already exists!"
-    
-    hashed_password = hash_password(password)
-    c.execute("INSERT INTO users (first_name, last_name, phone_number, email, password, role) VALUES (?, ?, ?, ?, ?, ?)",
-              (first_name, last_name, phone_number, email, hashed_password, role))
-    conn.commit()
-    return "Registration successful! You can now log in."
-
-def authenticate(email, password):
-    c.execute("SELECT * FROM users WHERE email=?", (email,))
-    user = c.fetchone()
-    
-    if user:
-        hashed_password = hash_password(password)
-        if user[4] == hashed_password:
-            return user[5]
-        else:
-            return "Incorrect password"
-    else:
-        return "User not found"
+import time
+
+from auth import SESSION_TTL, authenticate, issue_token, register_user, user_clinic, verify_token
+from rerun_stats import run_app
+
+# The users table is created when the pool is first opened, on the first login or registration.
+# The dashboards (and the model stack behind them) are only imported by show_dashboard().
 
 # UI pages
 def login_page():
@@ -56,18 +14,24 @@ def login_page():
     password = st.text_input("Password", type="password")
     
     if st.button("Login"):
-        role = authenticate(email, password)
+        # Password verification runs in auth's KDF thread pool
+        with st.spinner("Signing in..."):
+            role = authenticate(email, password)
         
         if role == "doctor":
             st.session_state.logged_in = True
             st.session_state.role = "doctor"
             st.session_state.email = email
+            st.session_state.clinic = user_clinic(email)
+            st.session_state.auth_token = issue_token(email, role)
             st.success("Login successful as Doctor!")
             return True
         elif role == "patient":
             st.session_state.logged_in = True
             st.session_state.role = "patient"
             st.session_state.email = email
+            st.session_state.clinic = user_clinic(email)
+            st.session_state.auth_token = issue_token(email, role)
             st.success("Login successful as Patient!")
             return True
         else:
@@ -87,6 +51,9 @@ def register_page():
     password = st.text_input("Password", type="password")
     confirm_password = st.text_input("Confirm Password", type="password")
     role = st.radio("Select Role", ["patient", "doctor"])
+    # Only existing clinics can be chosen; imported here so the login page does not load it
+    from patient_shards import get_store
+    clinic = st.selectbox("Clinic", get_store().clinics())
     
     if st.button("Register"):
         if not first_name or not last_name or not phone_number or not email or not password or not confirm_password:
@@ -94,7 +61,7 @@ def register_page():
         elif password != confirm_password:
             st.error("Passwords do not match!")
         else:
-            result = register_user(first_name, last_name, phone_number, email, password, role)
+            result = register_user(first_name, last_name, phone_number, email, password, role, clinic)
             if "successful" in result:
                 st.success(result)
                 st.session_state.current_page = "login"
@@ -104,18 +71,36 @@ def register_page():
     if st.button("Already have an account? Login here!"):
         st.session_state.current_page = "login"
 
+def show_dashboard(role):
+    # Imported on first navigation so the login page renders without loading them
+    if role == "doctor":
+        from doctor_dashboard import doctor_dashboard
+        doctor_dashboard()
+    elif role == "patient":
+        from patient_dashboard import patient_page
+        patient_page()
+
 # Main function
 def main():
     # Initialize session state if not already done
     if "logged_in" not in st.session_state:
         st.session_state.logged_in = False
 
+    # Reruns trust the signed session token instead of verifying the password again
+    if st.session_state.logged_in:
+        claims = verify_token(st.session_state.get("auth_token"))
+        if claims is None:
+            st.session_state.clear()
+            st.session_state.logged_in = False
+            st.session_state.current_page = "login"
+            st.warning("Your session has expired. Please log in again.")
+        elif claims["exp"] - time.time() < SESSION_TTL / 2:
+            # Sliding expiry: active sessions get a fresh token
+            st.session_state.auth_token = issue_token(claims["email"], claims["role"])
+
     # If the user is logged in, directly show their respective dashboard
     if st.session_state.logged_in:
-        if st.session_state.role == "doctor":
-            doctor_dashboard()
-        elif st.session_state.role == "patient":
-            patient_page()
+        show_dashboard(st.session_state.role)
 
     else:
         if "current_page" not in st.session_state:
@@ -123,10 +108,7 @@ def main():
 
         if st.session_state.current_page == "login":
             if login_page():
-                if st.session_state.role == "doctor":
-                   doctor_dashboard()
-                elif st.session_state.role == "patient":
-                    patient_page()
+                show_dashboard(st.session_state.role)
 
         elif st.session_state.current_page == "register":
             register_page()
@@ -142,10 +124,17 @@ def main():
    # if st.button("Logout"):
        # logout()
 
+def current_page():
+    # Label for this rerun in the latency metrics
+    if st.session_state.get("logged_in"):
+        return st.session_state.get("role", "dashboard")
+    return st.session_state.get("current_page", "login")
+
 def logout():
     # Clear the session state and redirect to login page
     st.session_state.clear()
     st.session_state.current_page = "login"
     st.success("You have logged out successfully!")
 if __name__ == "__main__":
-    main()
+    # Counted per session, timed when metrics are enabled, and profiled when a doctor arms the profiler
+    run_app(main, current_page)
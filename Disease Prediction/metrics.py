@@ -0,0 +1,363 @@
+"""Latency metrics for model scoring, database queries, reports and reruns.
+
+Hot paths are wrapped in timers:
+
+    with timer('model_seconds', model='heart', method='score'):
+        ...
+
+    @timed('model_seconds', model='heart', method='predict')
+    def predict(...):
+
+    future = executor.submit(render_pdf, ...)
+    time_future(future, 'report_seconds', kind='background')
+
+Every (metric, labels) series keeps a latency histogram, a call count and
+an error count (calls that raised). Collection is off unless
+DISEASE_PREDICTION_METRICS=1 is set or enable() is called. While it is off,
+timer() hands back a shared no-op and timed() calls straight through, so an
+instrumented call costs one flag check. SQLite statements are timed through
+db.add_query_hook(), which costs nothing while no hook is registered.
+
+prometheus_text() renders everything in the Prometheus text format. It is
+served on GET /metrics by inference_service.py and offered for download on
+the doctor dashboard's performance panel. If DISEASE_PREDICTION_METRICS_FILE
+is set, it is also written to that file every 15 seconds, e.g. for
+node_exporter's textfile collector.
+
+profile_rerun() times each Streamlit rerun. Once arm_profiler() is called,
+reruns run under cProfile until one takes longer than the given threshold,
+and that rerun's report is kept in `last_profile`.
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+
+PREFIX = 'disease_prediction_'
+
+# Histogram bucket upper bounds in seconds (the last bucket is +Inf)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+           10.0)
+
+# New series are dropped beyond this many, so ad-hoc SQL can't grow memory without bound
+MAX_SERIES = 1000
+
+HELP = {
+    'model_seconds': "Model scoring latency by model and method",
+    'db_query_seconds': "SQLite statement latency by database and statement",
+    'report_seconds': "PDF report rendering latency",
+    'rerun_seconds': "Streamlit script rerun latency by page (fragment reruns by page/fragment)",
+    'rerun_cpu_seconds': "CPU time of the script thread per Streamlit rerun, by page",
+    'http_request_seconds': "Inference service request latency by model",
+}
+
+enabled = False
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count', 'errors')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds, error=False):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        if error:
+            self.errors += 1
+
+    def quantile(self, q):
+        # Interpolated within the bucket, like Prometheus' histogram_quantile()
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if i == len(BUCKETS):
+                    return BUCKETS[-1]
+                lower = BUCKETS[i - 1] if i else 0.0
+                return lower + (BUCKETS[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return BUCKETS[-1]
+
+    def copy(self):
+        other = Histogram()
+        other.counts = list(self.counts)
+        other.sum, other.count, other.errors = self.sum, self.count, self.errors
+        return other
+
+
+class Registry:
+    def __init__(self):
+        self._series = {}
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def observe(self, name, labels, seconds, error=False):
+        # labels is a sorted tuple of (name, value) pairs
+        key = (name, labels)
+        with self._lock:
+            histogram = self._series.get(key)
+            if histogram is None:
+                if len(self._series) >= MAX_SERIES:
+                    self.dropped += 1
+                    return
+                histogram = self._series[key] = Histogram()
+            histogram.observe(seconds, error)
+
+    def series(self):
+        # [(name, labels, Histogram copy)] sorted by name and labels
+        with self._lock:
+            return sorted((name, labels, histogram.copy()) for (name, labels), histogram in self._series.items())
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self.dropped = 0
+
+
+registry = Registry()
+
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Streamlit's rerun/stop signals are BaseExceptions and don't count as errors
+        error = exc_type is not None and issubclass(exc_type, Exception)
+        registry.observe(self.name, self.labels, time.perf_counter() - self.start, error)
+        return False
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_no_timer = _NoTimer()
+
+
+def timer(name, **labels):
+    if not enabled:
+        return _no_timer
+    return _Timer(name, tuple(sorted(labels.items())))
+
+
+def timed(name, **labels):
+    labels = tuple(sorted(labels.items()))
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            error = False
+            try:
+                return fn(*args, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                registry.observe(name, labels, time.perf_counter() - start, error)
+        return wrapper
+    return decorator
+
+
+def time_future(future, name, **labels):
+    # Records the time from now until `future` finishes, e.g. a job in a process pool
+    if not enabled:
+        return
+    labels = tuple(sorted(labels.items()))
+    start = time.perf_counter()
+    future.add_done_callback(lambda f: registry.observe(
+        name, labels, time.perf_counter() - start, f.cancelled() or f.exception() is not None))
+
+
+def _query_hook(db_path, sql, seconds, failed):
+    # Whitespace-normalized statement text; the app only uses parameterized SQL
+    statement = ' '.join(sql.split())[:200]
+    registry.observe('db_query_seconds', (('db', os.path.basename(db_path)), ('query', statement)), seconds,
+                     failed)
+
+
+def enable():
+    global enabled
+    from db import add_query_hook
+
+    if not enabled:
+        enabled = True
+        add_query_hook(_query_hook)
+
+
+def disable():
+    global enabled
+    from db import remove_query_hook
+
+    if enabled:
+        enabled = False
+        remove_query_hook(_query_hook)
+
+
+def snapshot():
+    # One dict per series with the summary figures shown on the dashboard
+    rows = []
+    for name, labels, histogram in registry.series():
+        rows.append({
+            'metric': name,
+            'labels': dict(labels),
+            'count': histogram.count,
+            'errors': histogram.errors,
+            'total_seconds': histogram.sum,
+            'mean_seconds': histogram.sum / histogram.count if histogram.count else None,
+            'p50_seconds': histogram.quantile(0.5),
+            'p95_seconds': histogram.quantile(0.95),
+            'p99_seconds': histogram.quantile(0.99),
+        })
+    return rows
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def prometheus_text():
+    series = registry.series()
+    lines = []
+    for name in sorted({name for name, _, _ in series}):
+        metric = PREFIX + name
+        lines.append(f"# HELP {metric} {HELP.get(name, name)}")
+        lines.append(f"# TYPE {metric} histogram")
+        for _, labels, histogram in (s for s in series if s[0] == name):
+            cumulative = 0
+            for bound, count in zip(BUCKETS + (None,), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound is None else f"{bound:g}"
+                lines.append(f"{metric}_bucket{_format_labels(labels, [('le', le)])} {cumulative}")
+            lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum!r}")
+            lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+
+        errors = PREFIX + name.removesuffix('_seconds') + '_errors_total'
+        lines.append(f"# HELP {errors} Calls that raised, by the same labels as {metric}")
+        lines.append(f"# TYPE {errors} counter")
+        for _, labels, histogram in (s for s in series if s[0] == name):
+            lines.append(f"{errors}{_format_labels(labels)} {histogram.errors}")
+
+    lines.append(f"# HELP {PREFIX}metrics_dropped_total Observations dropped because of the series limit")
+    lines.append(f"# TYPE {PREFIX}metrics_dropped_total counter")
+    lines.append(f"{PREFIX}metrics_dropped_total {registry.dropped}")
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(path):
+    # Atomic, so a scraper never reads a half-written file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(prometheus_text())
+    os.replace(tmp_path, path)
+
+
+def start_file_export(path, interval=15.0):
+    def export():
+        while True:
+            time.sleep(interval)
+            try:
+                write_prometheus(path)
+            except OSError:
+                pass
+
+    thread = threading.Thread(target=export, name='metrics-export', daemon=True)
+    thread.start()
+    return thread
+
+
+# Rerun profiling: the minimum rerun time worth keeping while armed, else None
+_profile_min_seconds = None
+_profile_lock = threading.Lock()
+last_profile = None
+
+
+def arm_profiler(min_seconds=0.0):
+    global _profile_min_seconds
+    _profile_min_seconds = min_seconds
+
+
+def disarm_profiler():
+    global _profile_min_seconds
+    _profile_min_seconds = None
+
+
+def profiler_armed():
+    return _profile_min_seconds is not None
+
+
+def profile_rerun(fn, page, top=40):
+    # Runs one Streamlit rerun. `page` is called afterwards to label it (e.g. with the user's role).
+    global last_profile
+    if _profile_min_seconds is None or not _profile_lock.acquire(blocking=False):
+        if not enabled:
+            return fn()
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            registry.observe('rerun_seconds', (('page', page()),), time.perf_counter() - start)
+
+    # Only one rerun at a time is profiled; concurrent sessions run normally
+    import cProfile
+    import io
+    import pstats
+
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        profiler.enable()
+        try:
+            return fn()
+        finally:
+            profiler.disable()
+    finally:
+        seconds = time.perf_counter() - start
+        if enabled:
+            registry.observe('rerun_seconds', (('page', page()),), seconds)
+        min_seconds = _profile_min_seconds
+        if min_seconds is not None and seconds >= min_seconds:
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(top)
+            last_profile = {'page': page(), 'seconds': seconds, 'captured_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                            'report': report.getvalue()}
+            disarm_profiler()
+        _profile_lock.release()
+
+
+if os.environ.get('DISEASE_PREDICTION_METRICS') == '1':
+    enable()
+if os.environ.get('DISEASE_PREDICTION_METRICS_FILE'):
+    enable()
+    start_file_export(os.environ['DISEASE_PREDICTION_METRICS_FILE'])
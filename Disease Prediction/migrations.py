@@ -0,0 +1,257 @@
+"""Schema migrations for patients_data.db and main_app.db.
+
+The schema version is stored in PRAGMA user_version and every migration runs
+in its own transaction, so a database can be upgraded from any earlier
+version (including the original single patient_data table) by calling
+migrate(conn), or migrate_users(conn) for the users database. Run it by hand
+with:
+
+    python migrations.py [path/to/patients_data.db]
+"""
+import sqlite3
+import sys
+
+
+def _create_patient_data(conn):
+    # Version 1: the original table created by patient_dashboard.py
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS patient_data (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        disease TEXT,
+        diagnosis TEXT
+    )
+    """)
+
+
+def _normalize_patients(conn):
+    # Version 2: patients and diagnoses tables keyed by id, with timestamps.
+    # patient_data becomes a view over them so existing queries keep working.
+    conn.execute("""
+    CREATE TABLE patients (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL UNIQUE,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE diagnoses (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id INTEGER NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+        disease TEXT NOT NULL,
+        diagnosis TEXT NOT NULL,
+        recommendations TEXT,
+        created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(patient_data)")]
+    recommendations = 'pd.recommendations' if 'recommendations' in columns else 'NULL'
+    conn.execute("""
+    INSERT INTO patients (name)
+    SELECT DISTINCT name FROM patient_data WHERE name IS NOT NULL ORDER BY name
+    """)
+    conn.execute(f"""
+    INSERT INTO diagnoses (id, patient_id, disease, diagnosis, recommendations)
+    SELECT pd.id, p.id, COALESCE(pd.disease, ''), COALESCE(pd.diagnosis, ''), {recommendations}
+    FROM patient_data pd JOIN patients p ON p.name = pd.name
+    ORDER BY pd.id
+    """)
+    conn.execute("DROP TABLE patient_data")
+
+    # Covering index for listing a patient's records in id order
+    conn.execute("""
+    CREATE INDEX idx_diagnoses_patient
+    ON diagnoses (patient_id, id, disease, diagnosis)
+    """)
+    conn.execute("CREATE INDEX idx_diagnoses_created_at ON diagnoses (created_at)")
+
+    conn.execute("""
+    CREATE VIEW patient_data AS
+    SELECT d.id AS id, p.name AS name, d.disease AS disease, d.diagnosis AS diagnosis,
+           d.recommendations AS recommendations, d.created_at AS created_at, d.patient_id AS patient_id
+    FROM diagnoses d JOIN patients p ON p.id = d.patient_id
+    """)
+    conn.execute("""
+    CREATE TRIGGER patient_data_insert INSTEAD OF INSERT ON patient_data
+    BEGIN
+        INSERT OR IGNORE INTO patients (name) VALUES (NEW.name);
+        INSERT INTO diagnoses (patient_id, disease, diagnosis, recommendations)
+        VALUES ((SELECT id FROM patients WHERE name = NEW.name), NEW.disease, NEW.diagnosis, NEW.recommendations);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER patient_data_update INSTEAD OF UPDATE OF recommendations ON patient_data
+    BEGIN
+        UPDATE diagnoses SET recommendations = NEW.recommendations WHERE id = OLD.id;
+    END
+    """)
+
+
+def _add_risk_scores(conn):
+    # Version 3: model outputs stored as numbers so records can be ranked by risk.
+    # risk is the positive-class probability, score the raw decision value and
+    # contributions a little-endian float64 array with one entry per model feature.
+    conn.execute("ALTER TABLE diagnoses ADD COLUMN risk REAL")
+    conn.execute("ALTER TABLE diagnoses ADD COLUMN score REAL")
+    conn.execute("ALTER TABLE diagnoses ADD COLUMN contributions BLOB")
+    # Both include the rowid, so ORDER BY risk DESC, id DESC is read straight off the index
+    conn.execute("CREATE INDEX idx_diagnoses_risk ON diagnoses (risk)")
+    conn.execute("CREATE INDEX idx_diagnoses_disease_risk ON diagnoses (disease, risk)")
+
+    # Dropping the view also drops its triggers
+    conn.execute("DROP VIEW patient_data")
+    conn.execute("""
+    CREATE VIEW patient_data AS
+    SELECT d.id AS id, p.name AS name, d.disease AS disease, d.diagnosis AS diagnosis,
+           d.recommendations AS recommendations, d.created_at AS created_at, d.patient_id AS patient_id,
+           d.risk AS risk, d.score AS score
+    FROM diagnoses d JOIN patients p ON p.id = d.patient_id
+    """)
+    conn.execute("""
+    CREATE TRIGGER patient_data_insert INSTEAD OF INSERT ON patient_data
+    BEGIN
+        INSERT OR IGNORE INTO patients (name) VALUES (NEW.name);
+        INSERT INTO diagnoses (patient_id, disease, diagnosis, recommendations, risk, score)
+        VALUES ((SELECT id FROM patients WHERE name = NEW.name), NEW.disease, NEW.diagnosis, NEW.recommendations,
+                NEW.risk, NEW.score);
+    END
+    """)
+    conn.execute("""
+    CREATE TRIGGER patient_data_update INSTEAD OF UPDATE OF recommendations ON patient_data
+    BEGIN
+        UPDATE diagnoses SET recommendations = NEW.recommendations WHERE id = OLD.id;
+    END
+    """)
+
+
+# Positive diagnosis texts as written by the app when version 4 was added
+_POSITIVE_DIAGNOSES = "('The person is diabetic', 'The person has heart disease', 'The person has Parkinsons disease')"
+
+
+def _add_diagnosis_summaries(conn):
+    # Version 4: per-disease, per-day counts kept up to date by triggers, so the
+    # analytics panel reads a few hundred summary rows instead of scanning diagnoses
+    conn.execute("""
+    CREATE TABLE disease_daily_stats (
+        disease TEXT NOT NULL,
+        day TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        positive INTEGER NOT NULL,
+        risk_sum REAL NOT NULL,
+        risk_count INTEGER NOT NULL,
+        PRIMARY KEY (disease, day)
+    ) WITHOUT ROWID
+    """)
+    conn.execute(f"""
+    INSERT INTO disease_daily_stats (disease, day, total, positive, risk_sum, risk_count)
+    SELECT disease, date(created_at), COUNT(*), SUM(diagnosis IN {_POSITIVE_DIAGNOSES}),
+           TOTAL(risk), COUNT(risk)
+    FROM diagnoses GROUP BY disease, date(created_at)
+    """)
+
+    add = f"""
+        INSERT INTO disease_daily_stats (disease, day, total, positive, risk_sum, risk_count)
+        VALUES (NEW.disease, date(NEW.created_at), 1, NEW.diagnosis IN {_POSITIVE_DIAGNOSES},
+                COALESCE(NEW.risk, 0), NEW.risk IS NOT NULL)
+        ON CONFLICT (disease, day) DO UPDATE SET
+            total = total + 1,
+            positive = positive + excluded.positive,
+            risk_sum = risk_sum + excluded.risk_sum,
+            risk_count = risk_count + excluded.risk_count;
+    """
+    remove = f"""
+        UPDATE disease_daily_stats SET
+            total = total - 1,
+            positive = positive - (OLD.diagnosis IN {_POSITIVE_DIAGNOSES}),
+            risk_sum = risk_sum - COALESCE(OLD.risk, 0),
+            risk_count = risk_count - (OLD.risk IS NOT NULL)
+        WHERE disease = OLD.disease AND day = date(OLD.created_at);
+    """
+    conn.execute(f"CREATE TRIGGER diagnoses_stats_insert AFTER INSERT ON diagnoses BEGIN {add} END")
+    conn.execute(f"CREATE TRIGGER diagnoses_stats_delete AFTER DELETE ON diagnoses BEGIN {remove} END")
+    conn.execute(f"""
+    CREATE TRIGGER diagnoses_stats_update AFTER UPDATE OF disease, diagnosis, risk, created_at ON diagnoses
+    BEGIN {remove} {add} END
+    """)
+
+
+def _cover_diagnosis_listing(conn):
+    # Version 5: list_diagnoses() also reads created_at and risk; keep its index covering
+    conn.execute("DROP INDEX idx_diagnoses_patient")
+    conn.execute("""
+    CREATE INDEX idx_diagnoses_patient
+    ON diagnoses (patient_id, id, created_at, disease, diagnosis, risk)
+    """)
+
+
+def _create_users(conn):
+    # Version 1: the original users table created by login.py
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        first_name TEXT,
+        last_name TEXT,
+        phone_number TEXT,
+        email TEXT PRIMARY KEY,
+        password TEXT,
+        role TEXT
+    )
+    """)
+
+
+def _add_user_clinics(conn):
+    # Version 2: the clinic whose patient shard a user's records go to (see patient_shards.py)
+    conn.execute("ALTER TABLE users ADD COLUMN clinic TEXT NOT NULL DEFAULT 'default'")
+
+
+# Append new migrations at the end; never reorder or edit released ones
+MIGRATIONS = [
+    _create_patient_data,
+    _normalize_patients,
+    _add_risk_scores,
+    _add_diagnosis_summaries,
+    _cover_diagnosis_listing,
+]
+
+USERS_MIGRATIONS = [
+    _create_users,
+    _add_user_clinics,
+]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    conn.execute("PRAGMA foreign_keys = ON")
+    version = schema_version(conn)
+    for number, migration in enumerate(migrations[version:], start=version + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock
+            if schema_version(conn) >= number:
+                conn.rollback()
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return schema_version(conn)
+
+
+def migrate_users(conn):
+    return migrate(conn, USERS_MIGRATIONS)
+
+
+if __name__ == '__main__':
+    from db import PATIENTS_DB
+
+    db_path = sys.argv[1] if len(sys.argv) > 1 else PATIENTS_DB
+    conn = sqlite3.connect(db_path)
+    try:
+        print(f"{db_path} is at schema version {migrate(conn)}")
+    finally:
+        conn.close()
@@ -0,0 +1,120 @@
+"""Process-wide registry for the saved disease models.
+
+Each model is loaded on first use and then shared by every Streamlit session,
+batch job and thread in the process; it is reloaded if its file changes on
+disk. Running
+
+    python model_registry.py export
+
+writes uncompressed joblib copies next to the .sav files. When one of those is
+present (and not older than its .sav), it is loaded with mmap_mode='r' so the
+model arrays are memory-mapped from the OS page cache and shared between all
+worker processes on the host instead of being copied into each of them.
+"""
+import argparse
+import os
+import pickle
+import threading
+
+# Getting the working directory of the script
+working_dir = os.path.dirname(os.path.abspath(__file__))
+models_dir = f"{working_dir}/saved_models"
+
+MODEL_FILES = {
+    'diabetes': 'diabetes_model.sav',
+    'heart': 'heart_disease_model.sav',
+    'parkinsons': 'parkinsons_model.sav',
+}
+
+_models = {}
+_lock = threading.Lock()
+
+
+def model_path(key):
+    return f"{models_dir}/{MODEL_FILES[key]}"
+
+
+def mmap_path(key):
+    return os.path.splitext(model_path(key))[0] + '.joblib'
+
+
+def _load(key):
+    sav_path = model_path(key)
+    joblib_path = mmap_path(key)
+    if os.path.exists(joblib_path) and os.path.getmtime(joblib_path) >= os.path.getmtime(sav_path):
+        import joblib
+        return joblib.load(joblib_path, mmap_mode='r')
+
+    with open(sav_path, 'rb') as f:
+        return pickle.load(f)
+
+
+def file_signature(*paths):
+    # (mtime, size) of each file, or None if it doesn't exist
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def model_signature(key):
+    return file_signature(model_path(key), mmap_path(key))
+
+
+def get_model(key):
+    # Reloads the model if its .sav (or joblib copy) changed on disk
+    signature = model_signature(key)
+    entry = _models.get(key)
+    if entry is None or entry[1] != signature:
+        with _lock:
+            # Another thread may have loaded it while we waited for the lock
+            entry = _models.get(key)
+            if entry is None or entry[1] != signature:
+                entry = (_load(key), signature)
+                _models[key] = entry
+    return entry[0]
+
+
+def clear():
+    with _lock:
+        _models.clear()
+
+
+def export_mmap(keys=None):
+    import joblib
+
+    paths = []
+    for key in keys or MODEL_FILES:
+        with open(model_path(key), 'rb') as f:
+            model = pickle.load(f)
+        path = mmap_path(key)
+        tmp_path = f"{path}.tmp"
+        # Compression would prevent memory mapping, so keep the dump uncompressed
+        joblib.dump(model, tmp_path, compress=0)
+        os.replace(tmp_path, path)
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the saved disease models.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export = subparsers.add_parser('export', help="Write memory-mappable joblib copies of the models")
+    export.add_argument('models', nargs='*', help=f"Models to export (default: all of {', '.join(MODEL_FILES)})")
+    args = parser.parse_args(argv)
+
+    unknown = [key for key in args.models if key not in MODEL_FILES]
+    if unknown:
+        parser.error(f"Unknown model(s): {', '.join(unknown)}")
+
+    if args.command == 'export':
+        for path in export_mmap(args.models):
+            print(f"Exported {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+"""Patient records sharded by clinic.
+
+Each clinic's patients live in their own SQLite file, shards/<clinic>.db
+under the data directory. Every file has the full patients_data.db schema
+and its own connection pool and batched writer, so clinics never wait on
+each other's writes. The `default` clinic keeps using patients_data.db,
+which means a deployment with a single clinic behaves exactly as before.
+
+Writes and single-patient reads are routed to the clinic's shard:
+
+    store = get_store()
+    store.write(clinic, lambda conn: add_diagnosis(conn, name, disease, diagnosis))
+    rows = store.read(clinic, list_diagnoses, patient_id)
+
+Every store.write() also bumps the clinic's version (see versions()). The
+doctor dashboard keys its cached listings on these versions, so a write from
+any session in the process invalidates them.
+
+The doctor's listings fan out to every shard in parallel and merge the
+per-shard pages. Merging keeps keyset pagination: the cursors include the
+clinic, so a page never costs more than one index range scan per shard.
+
+Clinics are only created explicitly, never by a write or a registration
+naming a clinic that does not exist yet:
+
+    python patient_shards.py add nairobi-west
+
+Storage is pluggable. A backend is any object with clinics(), returning the
+clinic ids, create(clinic), and pool(clinic), returning a
+db.ConnectionPool-like object with connection() and write(fn) that raises
+ValueError for an unknown clinic. Pass a different backend to set_backend(),
+e.g. a stand-in for a networked database. SQLiteShardBackend is the default.
+
+Split an existing patients_data.db into shards with
+
+    python patient_shards.py split clinics.csv
+    python patient_shards.py list
+
+where clinics.csv has `name,clinic` rows naming existing clinics. Patients
+not listed stay in the default clinic. Each chunk of patients is copied in one transaction and only
+then deleted from the source. The shard records which source diagnoses it
+received in the same transaction, and only those are deleted, so an
+interrupted split can simply be run again and records written to the source
+in the meantime move on the next run. Patients the shard already had under
+the same name are merged.
+"""
+import argparse
+import csv
+import heapq
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from db import CLINIC_ID, DEFAULT_CLINIC, PATIENTS_DB, SHARDS_DIR, get_pool
+from migrations import migrate
+from patient_store import PAGE_SIZE, daily_trend, disease_totals, list_by_risk, list_patients
+
+# Largest SQLite rowid, used to build inclusive keyset bounds
+MAX_ID = 2 ** 63 - 1
+
+# Upper bound on concurrent shard queries in one fan-out
+FAN_OUT_WORKERS = 16
+_fan_out_pool = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS, thread_name_prefix='shard')
+
+
+def check_clinic(clinic):
+    if not isinstance(clinic, str) or not CLINIC_ID.match(clinic):
+        raise ValueError(f"Invalid clinic id {clinic!r}: use letters, digits, '-' and '_' (at most 64)")
+    return clinic
+
+
+class SQLiteShardBackend:
+    # One SQLite file per clinic; the default clinic is the original patients database
+    def __init__(self, shards_dir=SHARDS_DIR, default_path=PATIENTS_DB):
+        self.shards_dir = shards_dir
+        self.default_path = default_path
+
+    def path(self, clinic):
+        if clinic == DEFAULT_CLINIC:
+            return self.default_path
+        return f"{self.shards_dir}/{check_clinic(clinic)}.db"
+
+    def clinics(self):
+        try:
+            names = os.listdir(self.shards_dir)
+        except FileNotFoundError:
+            names = []
+        shards = sorted(name[:-3] for name in names if name.endswith('.db') and CLINIC_ID.match(name[:-3]))
+        return sorted({DEFAULT_CLINIC, *shards})
+
+    def pool(self, clinic):
+        path = self.path(clinic)
+        if path != self.default_path and not os.path.exists(path):
+            raise ValueError(f"Unknown clinic {clinic!r}: add it with `python patient_shards.py add {clinic}`")
+        return get_pool(path, setup=migrate)
+
+    def create(self, clinic):
+        # Creates the clinic's shard with the current schema; a no-op for an existing clinic
+        path = self.path(clinic)
+        if path != self.default_path:
+            os.makedirs(self.shards_dir, exist_ok=True)
+        return get_pool(path, setup=migrate)
+
+
+class ShardedPatientStore:
+    def __init__(self, backend):
+        self.backend = backend
+        # Writes made through this store per clinic; the doctor dashboard's caches are keyed on them
+        self._versions = {}
+        self._versions_lock = threading.Lock()
+
+    def clinics(self):
+        return self.backend.clinics()
+
+    def pool(self, clinic):
+        return self.backend.pool(clinic)
+
+    def create(self, clinic):
+        self.backend.create(check_clinic(clinic))
+
+    def read(self, clinic, query, *args, **kwargs):
+        # Runs one patient_store query on the clinic's shard
+        with self.backend.pool(clinic).connection() as conn:
+            return query(conn, *args, **kwargs)
+
+    def write(self, clinic, fn):
+        try:
+            return self.backend.pool(clinic).write(fn)
+        finally:
+            with self._versions_lock:
+                self._versions[clinic] = self._versions.get(clinic, 0) + 1
+
+    def versions(self, clinics=None):
+        # ((clinic, version), ...), which changes whenever one of the clinics is written to
+        # through this store or a new clinic appears
+        clinics = self.clinics() if clinics is None else clinics
+        return tuple((clinic, self._versions.get(clinic, 0)) for clinic in clinics)
+
+    def fan_out(self, fn, clinics=None):
+        # Calls fn(clinic, conn) on every shard, in parallel, and returns {clinic: result}
+        clinics = self.clinics() if clinics is None else clinics
+
+        def run(clinic):
+            with self.backend.pool(clinic).connection() as conn:
+                return fn(clinic, conn)
+
+        if len(clinics) == 1:
+            return {clinics[0]: run(clinics[0])}
+        return dict(zip(clinics, _fan_out_pool.map(run, clinics)))
+
+    def list_patients(self, after=None, limit=PAGE_SIZE, prefix=None, clinics=None):
+        # Returns [(clinic, patient_id, name)] ordered by (name, clinic).
+        # `after` is the (name, clinic) of the last row on the previous page.
+        def page(clinic, conn):
+            if after is None:
+                rows = list_patients(conn, None, limit, prefix=prefix)
+            else:
+                # Same name in a later clinic still comes after the cursor
+                rows = list_patients(conn, after[0], limit, prefix=prefix, inclusive=clinic > after[1])
+            return [(clinic, patient_id, name) for patient_id, name in rows]
+
+        pages = self.fan_out(page, clinics).values()
+        return list(islice(heapq.merge(*pages, key=lambda row: (row[2], row[0])), limit))
+
+    def list_by_risk(self, disease=None, min_risk=0.0, after=None, limit=PAGE_SIZE, clinics=None):
+        # Returns [(clinic, diagnosis_id, name, disease, diagnosis, risk)], highest risk first, ties by
+        # clinic then newest record. `after` is the (risk, clinic, diagnosis_id) of the last row shown.
+        def page(clinic, conn):
+            if after is None:
+                shard_after = None
+            else:
+                risk, after_clinic, after_id = after
+                # Clinics sorting before the cursor's have already shown every row at this risk,
+                # later ones none of them
+                shard_after = (risk, after_id if clinic == after_clinic else 0 if clinic < after_clinic else MAX_ID)
+            return [(clinic, *row) for row in list_by_risk(conn, disease, min_risk, shard_after, limit)]
+
+        pages = self.fan_out(page, clinics).values()
+        return list(islice(heapq.merge(*pages, key=lambda row: (-row[5], row[0], -row[1])), limit))
+
+    def disease_summary(self, clinics=None):
+        # Returns [(disease, diagnoses, positive, mean_risk)] over all shards
+        totals = {}
+        for rows in self.fan_out(lambda clinic, conn: disease_totals(conn), clinics).values():
+            for disease, total, positive, risk_sum, risk_count in rows:
+                merged = totals.setdefault(disease, [0, 0, 0.0, 0])
+                merged[0] += total
+                merged[1] += positive
+                merged[2] += risk_sum
+                merged[3] += risk_count
+        return [(disease, total, positive, risk_sum / risk_count if risk_count else None)
+                for disease, (total, positive, risk_sum, risk_count) in sorted(totals.items()) if total > 0]
+
+    def daily_trend(self, since=None, clinics=None):
+        # Returns [(day, disease, diagnoses, positive)] summed over all shards
+        totals = {}
+        for rows in self.fan_out(lambda clinic, conn: daily_trend(conn, since), clinics).values():
+            for day, disease, total, positive in rows:
+                merged = totals.setdefault((day, disease), [0, 0])
+                merged[0] += total
+                merged[1] += positive
+        return [(day, disease, total, positive) for (day, disease), (total, positive) in sorted(totals.items())]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    # One store per process, over the SQLite shards unless set_backend() was called
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ShardedPatientStore(SQLiteShardBackend())
+    return _store
+
+
+def set_backend(backend):
+    global _store
+    with _store_lock:
+        _store = ShardedPatientStore(backend)
+    return _store
+
+
+def read_assignments(path):
+    # {patient name: clinic} from a CSV file with name and clinic columns
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        if not reader.fieldnames or not {'name', 'clinic'} <= set(reader.fieldnames):
+            raise ValueError(f"{path} needs 'name' and 'clinic' columns")
+        return {row['name']: check_clinic(row['clinic'].strip()) for row in reader}
+
+
+def _copy_patients(source, target, names):
+    # Copies the named patients and their diagnoses, skipping diagnoses an earlier run already copied.
+    # Returns the source ids of every diagnosis of these patients that the shard now holds.
+    target.execute("CREATE TABLE IF NOT EXISTS split_copied_diagnoses (source_id INTEGER PRIMARY KEY)")
+    copied_ids = []
+    for name in names:
+        patient = source.execute("SELECT id, created_at FROM patients WHERE name = ?", (name,)).fetchone()
+        if patient is None:
+            continue
+        # The shard may already have this patient from records written since it went live
+        target.execute("INSERT OR IGNORE INTO patients (name, created_at) VALUES (?, ?)", (name, patient[1]))
+        patient_id = target.execute("SELECT id FROM patients WHERE name = ?", (name,)).fetchone()[0]
+        rows = source.execute(
+            "SELECT id, disease, diagnosis, recommendations, created_at, risk, score, contributions FROM diagnoses "
+            "WHERE patient_id = ? ORDER BY id",
+            (patient[0],)
+        ).fetchall()
+        for source_id, *row in rows:
+            # Diagnosis ids are AUTOINCREMENT, so a copied id never comes back as a new record
+            done = target.execute("SELECT 1 FROM split_copied_diagnoses WHERE source_id = ?", (source_id,))
+            if not done.fetchone():
+                target.execute(
+                    "INSERT INTO diagnoses (patient_id, disease, diagnosis, recommendations, created_at, risk, "
+                    "score, contributions) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (patient_id, *row)
+                )
+                target.execute("INSERT INTO split_copied_diagnoses (source_id) VALUES (?)", (source_id,))
+            copied_ids.append(source_id)
+    return copied_ids
+
+
+def split(assignments, source_path=PATIENTS_DB, backend=None, chunksize=500, dry_run=False, verbose=True):
+    # Moves every patient listed in `assignments` ({name: clinic}) from source_path to its clinic's shard
+    backend = backend or SQLiteShardBackend()
+    source = sqlite3.connect(source_path, timeout=30)
+    source.execute("PRAGMA foreign_keys = ON")
+    migrate(source)
+    present = {name for (name,) in source.execute("SELECT name FROM patients")}
+    by_clinic = {}
+    for name, clinic in assignments.items():
+        if name in present and clinic != DEFAULT_CLINIC:
+            by_clinic.setdefault(clinic, []).append(name)
+
+    moved = {}
+    start = time.perf_counter()
+    try:
+        # A typo in the assignments must not create a new clinic
+        unknown = sorted(set(by_clinic) - set(backend.clinics()))
+        if unknown:
+            raise ValueError(f"Unknown clinic(s) {', '.join(unknown)}: add them with "
+                             f"`python patient_shards.py add` first")
+        for clinic, names in sorted(by_clinic.items()):
+            if dry_run:
+                moved[clinic] = len(names)
+                continue
+            target = sqlite3.connect(backend.path(clinic), timeout=30)
+            try:
+                target.execute("PRAGMA journal_mode = WAL")
+                target.execute("PRAGMA foreign_keys = ON")
+                migrate(target)
+                moved[clinic] = 0
+                for i in range(0, len(names), chunksize):
+                    chunk = names[i:i + chunksize]
+                    # Commit the copy before deleting, so a crash in between only leaves
+                    # duplicates the next run skips and then deletes
+                    with target:
+                        copied_ids = _copy_patients(source, target, chunk)
+                    with source:
+                        # Only the copied diagnoses are deleted: ones written to the source since are
+                        # kept, along with their patient, for the next run. The summary triggers keep
+                        # the source's analytics in step.
+                        source.executemany("DELETE FROM diagnoses WHERE id = ?", ((i,) for i in copied_ids))
+                        moved[clinic] += source.executemany(
+                            "DELETE FROM patients WHERE name = ? AND NOT EXISTS "
+                            "(SELECT 1 FROM diagnoses WHERE patient_id = patients.id)",
+                            ((name,) for name in chunk)
+                        ).rowcount
+                    if verbose:
+                        print(f"{clinic}: {min(i + chunksize, len(names))}/{len(names)} patients moved")
+            finally:
+                target.close()
+    finally:
+        source.close()
+    return moved, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage the per-clinic patient shards.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    split_parser = commands.add_parser('split', help="Move patients from patients_data.db to their clinics' shards")
+    split_parser.add_argument('assignments', help="CSV file with name and clinic columns")
+    split_parser.add_argument('--source', default=PATIENTS_DB)
+    split_parser.add_argument('--chunksize', type=int, default=500, help="Patients per transaction")
+    split_parser.add_argument('--dry-run', action='store_true', help="Only report how many patients would move")
+    commands.add_parser('list', help="Show every clinic with its patient and diagnosis counts")
+    add_parser = commands.add_parser('add', help="Create a clinic's shard")
+    add_parser.add_argument('clinic')
+    args = parser.parse_args(argv)
+
+    if args.command == 'add':
+        try:
+            get_store().create(args.clinic)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Adding the clinic failed: {e}", file=sys.stderr)
+            return 1
+        print(f"{args.clinic}: {get_store().backend.path(args.clinic)}")
+        return 0
+
+    if args.command == 'split':
+        try:
+            moved, elapsed = split(read_assignments(args.assignments), args.source, chunksize=args.chunksize,
+                                   dry_run=args.dry_run)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            print(f"Split failed: {e}", file=sys.stderr)
+            return 1
+        for clinic, count in moved.items():
+            print(f"{clinic}: {count} patients {'would move' if args.dry_run else 'moved'}")
+        print(f"Done in {elapsed:.2f}s")
+        return 0
+
+    store = get_store()
+    counts = store.fan_out(lambda clinic, conn: conn.execute(
+        "SELECT (SELECT COUNT(*) FROM patients), (SELECT COUNT(*) FROM diagnoses)").fetchone())
+    for clinic, (patients, diagnoses) in counts.items():
+        print(f"{clinic}: {patients} patients, {diagnoses} diagnoses ({store.backend.path(clinic)})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
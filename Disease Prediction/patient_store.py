@@ -0,0 +1,121 @@
+"""Queries over the normalized patients/diagnoses tables.
+
+Listings use keyset pagination: callers pass the last name or id they
+showed, and the next page is read straight off an index. The cost of each
+page does not grow with the number of rows. Risk listings page through the
+(risk, id) indexes the same way. Cohort analytics read the trigger-maintained
+disease_daily_stats table rather than scanning diagnoses.
+"""
+import numpy as np
+
+PAGE_SIZE = 50
+
+
+def list_patients(conn, after_name=None, limit=PAGE_SIZE, prefix=None, inclusive=False):
+    # Returns [(patient_id, name)] ordered by name, starting after `after_name` (or at it, if inclusive)
+    clauses, params = [], []
+    if after_name is not None:
+        clauses.append("name >= ?" if inclusive else "name > ?")
+        params.append(after_name)
+    if prefix:
+        # Prefix search stays a range scan on the unique name index
+        clauses.append("name >= ? AND name < ?")
+        params.extend([prefix, prefix + '\U0010ffff'])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return conn.execute(
+        f"SELECT id, name FROM patients {where} ORDER BY name LIMIT ?", (*params, limit)
+    ).fetchall()
+
+
+def list_diagnoses(conn, patient_id, after_id=0, limit=PAGE_SIZE):
+    # Returns [(diagnosis_id, created_at, disease, diagnosis, risk)] in the order they were recorded
+    return conn.execute(
+        "SELECT id, created_at, disease, diagnosis, risk FROM diagnoses WHERE patient_id = ? AND id > ? "
+        "ORDER BY id LIMIT ?",
+        (patient_id, after_id, limit)
+    ).fetchall()
+
+
+def disease_summary(conn):
+    # Returns [(disease, diagnoses, positive, mean_risk)] over all time
+    return conn.execute(
+        "SELECT disease, SUM(total), SUM(positive), TOTAL(risk_sum) / NULLIF(SUM(risk_count), 0) "
+        "FROM disease_daily_stats GROUP BY disease HAVING SUM(total) > 0 ORDER BY disease"
+    ).fetchall()
+
+
+def disease_totals(conn):
+    # Returns [(disease, diagnoses, positive, risk_sum, risk_count)], for merging summaries across shards
+    return conn.execute(
+        "SELECT disease, SUM(total), SUM(positive), TOTAL(risk_sum), SUM(risk_count) "
+        "FROM disease_daily_stats GROUP BY disease ORDER BY disease"
+    ).fetchall()
+
+
+def daily_trend(conn, since=None):
+    # Returns [(day, disease, diagnoses, positive)] for days on or after `since` (YYYY-MM-DD)
+    return conn.execute(
+        "SELECT day, disease, total, positive FROM disease_daily_stats WHERE day >= ? AND total > 0 "
+        "ORDER BY day, disease",
+        (since or '',)
+    ).fetchall()
+
+
+def list_by_risk(conn, disease=None, min_risk=0.0, after=None, limit=PAGE_SIZE):
+    # Returns [(diagnosis_id, name, disease, diagnosis, risk)], highest risk first.
+    # `after` is the (risk, diagnosis_id) of the last row on the previous page.
+    clauses, params = ["d.risk >= ?"], [min_risk]
+    if disease is not None:
+        clauses.append("d.disease = ?")
+        params.append(disease)
+    if after is not None:
+        clauses.append("(d.risk, d.id) < (?, ?)")
+        params.extend(after)
+    return conn.execute(
+        f"SELECT d.id, p.name, d.disease, d.diagnosis, d.risk FROM diagnoses d JOIN patients p ON p.id = d.patient_id "
+        f"WHERE {' AND '.join(clauses)} ORDER BY d.risk DESC, d.id DESC LIMIT ?",
+        (*params, limit)
+    ).fetchall()
+
+
+def get_diagnosis(conn, diagnosis_id):
+    return conn.execute(
+        "SELECT id, patient_id, disease, diagnosis, recommendations, created_at, risk, score, contributions "
+        "FROM diagnoses WHERE id = ?",
+        (diagnosis_id,)
+    ).fetchone()
+
+
+def encode_contributions(contributions):
+    return None if contributions is None else np.asarray(contributions, dtype='<f8').tobytes()
+
+
+def decode_contributions(blob):
+    return None if blob is None else np.frombuffer(blob, dtype='<f8')
+
+
+def add_diagnosis(conn, name, disease, diagnosis, risk=None, score=None, contributions=None):
+    conn.execute("INSERT OR IGNORE INTO patients (name) VALUES (?)", (name,))
+    cursor = conn.execute(
+        "INSERT INTO diagnoses (patient_id, disease, diagnosis, risk, score, contributions) "
+        "VALUES ((SELECT id FROM patients WHERE name = ?), ?, ?, ?, ?, ?)",
+        (name, disease, diagnosis, risk, score, encode_contributions(contributions))
+    )
+    return cursor.lastrowid
+
+
+def add_diagnoses(conn, rows):
+    # Bulk version of add_diagnosis for (name, disease, diagnosis[, risk, score, contributions]) rows
+    rows = [(*row, None, None, None)[:6] for row in rows]
+    conn.executemany("INSERT OR IGNORE INTO patients (name) VALUES (?)", ((row[0],) for row in rows))
+    conn.executemany(
+        "INSERT INTO diagnoses (patient_id, disease, diagnosis, risk, score, contributions) "
+        "VALUES ((SELECT id FROM patients WHERE name = ?), ?, ?, ?, ?, ?)",
+        ((name, disease, diagnosis, risk, score, encode_contributions(contributions))
+         for name, disease, diagnosis, risk, score, contributions in rows)
+    )
+
+
+def set_recommendations(conn, diagnosis_id, recommendations):
+    # Updates exactly one record, unlike matching on (name, disease, diagnosis)
+    conn.execute("UPDATE diagnoses SET recommendations = ? WHERE id = ?", (recommendations, diagnosis_id))
@@ -0,0 +1,118 @@
+"""Bounded LRU/TTL cache for single-patient predictions.
+
+Streamlit reruns the whole page on every interaction and clinicians often
+resubmit the same inputs, so identical predictions are served from memory.
+Entries are keyed on (disease, pipeline version, canonical feature tuple)
+and hold the full single-row score (label, risk, decision value and
+per-feature contributions).
+When a model file changes on disk, get_pipeline() returns a new version and
+the entries cached for the old one are dropped.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from feature_schema import to_array
+from inference_pipeline import get_pipeline
+
+
+class PredictionCache:
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, disease, keep_version=None):
+        # Drop every entry for `disease` except those for `keep_version`
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == disease and key[1] != keep_version]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+
+prediction_cache = PredictionCache()
+_versions = {}
+
+
+def canonical_features(features):
+    # 5, 5.0 and numpy scalars all map to the same key
+    return tuple(float(value) for value in features)
+
+
+def cached_score(disease, features):
+    # Returns {'prediction', 'risk', 'score', 'contributions', 'calibrated'} for one patient
+    pipeline = get_pipeline(disease)
+    if _versions.get(disease) != pipeline.version:
+        # The model changed on disk: forget predictions from the old one
+        prediction_cache.invalidate(disease, keep_version=pipeline.version)
+        _versions[disease] = pipeline.version
+
+    key = (disease, pipeline.version, canonical_features(features))
+    result = prediction_cache.get(key)
+    if result is None:
+        # Only misses are validated; cached keys have already passed the schema
+        scores = pipeline.score(to_array(disease, [key[2]]))
+        contributions = scores['contributions']
+        result = {
+            'prediction': scores['prediction'][0].item(),
+            'risk': None if scores['risk'] is None else float(scores['risk'][0]),
+            'score': float(scores['score'][0]),
+            'contributions': None if contributions is None else tuple(contributions[0].tolist()),
+            'calibrated': scores['calibrated'],
+        }
+        prediction_cache.put(key, result)
+    return result
+
+
+def cached_predict(disease, features):
+    return cached_score(disease, features)['prediction']
@@ -0,0 +1,174 @@
+"""Background PDF report rendering for the doctor dashboard.
+
+Reports are rendered in a process pool so the doctor's Streamlit session is
+never blocked by FPDF. Each report is cached under reports/ by a hash of the
+patient record and the recommendations, so identical requests reuse the
+existing file and different patients with the same name no longer overwrite
+each other's reports. A job is identified by that hash, so once its report is
+written the service only needs the file to answer for it.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import time_future
+
+# Getting the working directory of the script
+working_dir = os.path.dirname(os.path.abspath(__file__))
+reports_dir = f"{working_dir}/reports"
+
+
+def report_key(patient_data, recommendations):
+    payload = json.dumps({'patient': patient_data, 'recommendations': recommendations or ''},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def report_path(patient_data, recommendations):
+    return f"{reports_dir}/{report_key(patient_data, recommendations)}.pdf"
+
+
+def render_pdf(patient_data, recommendations, file_path):
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+    pdf.cell(200, 10, txt="Patient Diagnosis Report", ln=True, align='C')
+    pdf.ln(10)
+
+    # Add patient data
+    for key, value in patient_data.items():
+        pdf.cell(0, 10, txt=f"{key}: {value}", ln=True)
+
+    pdf.ln(10)
+    pdf.cell(0, 10, txt="Doctor's Recommendations:", ln=True)
+    pdf.multi_cell(0, 10, txt=recommendations or '')
+
+    # Write to a temporary file first so a half-written PDF never looks cached
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    pdf.output(tmp_path)
+    os.replace(tmp_path, file_path)
+    return file_path
+
+
+class ReportService:
+    # A job id is the report's cache key. Only jobs still rendering and recent failures are kept in
+    # memory; a finished report is known by its file, so the service does not grow with every click.
+    def __init__(self, max_workers=None, max_failures=1000):
+        self.max_workers = max_workers
+        self.max_failures = max_failures
+        self._executor = None
+        self._pending = {}
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn avoids forking the Streamlit server and its threads
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _submit_render(self, patient_data, recommendations, file_path):
+        try:
+            return self._get_executor().submit(render_pdf, patient_data, recommendations, file_path)
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory) and took the pool with it; start a new one once
+            self._executor.shutdown(wait=False)
+            self._executor = None
+            return self._get_executor().submit(render_pdf, patient_data, recommendations, file_path)
+
+    def _fail(self, job_id, error):
+        # Called with the lock held
+        self._failures[job_id] = str(error)
+        self._failures.move_to_end(job_id)
+        while len(self._failures) > self.max_failures:
+            self._failures.popitem(last=False)
+
+    def _finished(self, job_id, future):
+        with self._lock:
+            if self._pending.get(job_id) is future:
+                del self._pending[job_id]
+            error = None if future.cancelled() else future.exception()
+            if error is not None:
+                self._fail(job_id, error)
+
+    def submit(self, patient_data, recommendations):
+        job_id = report_key(patient_data, recommendations)
+        file_path = f"{reports_dir}/{job_id}.pdf"
+        with self._lock:
+            # Reuse a job already rendering the same report
+            if job_id in self._pending or os.path.exists(file_path):
+                return job_id
+            self._failures.pop(job_id, None)
+            try:
+                future = self._submit_render(patient_data, recommendations, file_path)
+            except (BrokenProcessPool, OSError) as e:
+                # Could not start workers; the dashboard shows the job as failed
+                self._fail(job_id, f"could not start a report worker: {e}")
+                return job_id
+            # Includes the time spent waiting for a free worker
+            time_future(future, 'report_seconds', kind='background')
+            self._pending[job_id] = future
+        # Outside the lock: a future that is already done runs the callback right away
+        future.add_done_callback(lambda future: self._finished(job_id, future))
+        return job_id
+
+    def submit_bulk(self, reports):
+        # reports is an iterable of (patient_data, recommendations) pairs
+        return [self.submit(patient_data, recommendations) for patient_data, recommendations in reports]
+
+    def status(self, job_id):
+        # Returns (state, file path or error message)
+        with self._lock:
+            future = self._pending.get(job_id)
+            error = self._failures.get(job_id)
+        if future is not None and not future.done():
+            return ('running' if future.running() else 'queued'), None
+        if future is not None and (future.cancelled() or future.exception() is not None):
+            error = 'cancelled' if future.cancelled() else str(future.exception())
+        if error is not None:
+            return 'failed', error
+        file_path = f"{reports_dir}/{job_id}.pdf"
+        if os.path.exists(file_path):
+            return 'done', file_path
+        return 'unknown', None
+
+    def wait(self, job_ids, timeout=None):
+        # File paths of the reports, raising if one failed
+        paths = []
+        for job_id in job_ids:
+            with self._lock:
+                future = self._pending.get(job_id)
+            if future is not None:
+                future.result(timeout)
+            state, result = self.status(job_id)
+            if state != 'done':
+                raise RuntimeError(f"Report {job_id} {state}: {result}")
+            paths.append(result)
+        return paths
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_report_service():
+    # One pool per server process, shared by every session
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ReportService()
+    return _service
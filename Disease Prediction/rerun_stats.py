@@ -0,0 +1,119 @@
+"""Per-session rerun counts and latencies for the Streamlit pages.
+
+A widget change reruns the whole script (login.main) unless the widget is
+inside an st.fragment, in which case only that fragment runs again. Forms
+hold back reruns until they are submitted. run_app() and fragment() count
+both kinds of rerun in the session's state, with their wall-clock and CPU
+time (time.thread_time() of the session's script thread), so the readout
+shows what an interaction costs the server:
+
+    @rerun_stats.fragment('doctor/analytics')
+    def show_analytics(clinics):
+        ...
+
+When metrics.py is collecting, fragment reruns are also recorded in
+rerun_seconds under their own page label, e.g. page="doctor/analytics", and
+every rerun's CPU time in rerun_cpu_seconds.
+"""
+import functools
+import threading
+import time
+
+import streamlit as st
+
+import metrics
+from auth import SESSION_TTL, issue_token, verify_token
+
+STATE_KEY = 'rerun_stats'
+
+# Set while a full script rerun is running on this thread
+_local = threading.local()
+
+
+def _record(scope, page, seconds, cpu_seconds):
+    # Per scope ('app' or the fragment's name): [reruns, total s, total CPU s, last s, last CPU s]
+    stats = st.session_state.setdefault(STATE_KEY, {})
+    entry = stats.setdefault(scope, [0, 0.0, 0.0, 0.0, 0.0])
+    entry[0] += 1
+    entry[1] += seconds
+    entry[2] += cpu_seconds
+    entry[3] = seconds
+    entry[4] = cpu_seconds
+    if metrics.enabled:
+        labels = (('page', page),)
+        if scope != 'app':
+            metrics.registry.observe('rerun_seconds', labels, seconds)
+        metrics.registry.observe('rerun_cpu_seconds', labels, cpu_seconds)
+
+
+def run_app(main, page):
+    # Runs one full rerun of the app through metrics.profile_rerun()
+    _local.full_rerun = True
+    start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        return metrics.profile_rerun(main, page)
+    finally:
+        _local.full_rerun = False
+        _record('app', page(), time.perf_counter() - start, time.thread_time() - cpu_start)
+
+
+def _session_valid():
+    # Same token check login.main() makes, including the sliding renewal
+    if not st.session_state.get('logged_in'):
+        return True
+    claims = verify_token(st.session_state.get('auth_token'))
+    if claims is None:
+        return False
+    if claims['exp'] - time.time() < SESSION_TTL / 2:
+        st.session_state.auth_token = issue_token(claims['email'], claims['role'])
+    return True
+
+
+def fragment(name, run_every=None):
+    # st.fragment that counts the reruns it runs on its own; during a full rerun it is part of 'app'.
+    # With run_every (seconds) it also reruns itself on that interval, e.g. to poll a background job.
+    def decorator(fn):
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            if getattr(_local, 'full_rerun', False):
+                return fn(*args, **kwargs)
+            if not _session_valid():
+                # Fragment reruns skip login.main(); the full rerun logs the expired session out
+                st.rerun(scope='app')
+            start, cpu_start = time.perf_counter(), time.thread_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(name, name, time.perf_counter() - start, time.thread_time() - cpu_start)
+        return st.fragment(run, run_every=run_every)
+    return decorator
+
+
+def rerun():
+    # Reruns the current fragment, or the whole app when the fragment is part of a full rerun
+    st.rerun(scope='app' if getattr(_local, 'full_rerun', False) else 'fragment')
+
+
+def readout():
+    # [(scope, reruns, mean ms, mean CPU ms, last ms, last CPU ms)] for this session, full reruns first
+    stats = st.session_state.get(STATE_KEY, {})
+    return [(scope, count, total / count * 1000, cpu / count * 1000, last * 1000, last_cpu * 1000)
+            for scope, (count, total, cpu, last, last_cpu) in sorted(stats.items(), key=lambda s: s[0] != 'app')]
+
+
+def show_readout():
+    # One caption line: how many full and partial reruns this session made and what they cost
+    stats = st.session_state.get(STATE_KEY)
+    if not stats:
+        return
+    parts = []
+    for label, entries in (("full", [v for k, v in stats.items() if k == 'app']),
+                           ("partial", [v for k, v in stats.items() if k != 'app'])):
+        count = sum(entry[0] for entry in entries)
+        if count:
+            total = sum(entry[1] for entry in entries) / count * 1000
+            cpu = sum(entry[2] for entry in entries) / count * 1000
+            parts.append(f"{count} {label} (mean {total:.1f} ms, {cpu:.1f} ms CPU)")
+        else:
+            parts.append(f"0 {label}")
+    st.caption(f"Reruns this session: {', '.join(parts)}")
@@ -0,0 +1,123 @@
+"""Import-time profile of the app's entry points.
+
+Imports each module in a fresh interpreter with `python -X importtime` and
+reports the slowest imports. Two checks run against the login page, which
+every user loads. First, its cold import must stay under a time budget.
+Second, it must not import any of the modules deferred to first navigation
+(the dashboards, fpdf, streamlit_option_menu and the model stack):
+
+    python startup_profile.py
+    python startup_profile.py login patient_dashboard --top 30
+    python startup_profile.py --budget-ms 400 --json
+
+Exits with status 1 if a check fails, so it can run in CI.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+# Cold-import budget for the login page, in milliseconds. Streamlit alone
+# accounts for most of it.
+STARTUP_BUDGET_MS = 600
+
+# Modules that must only be imported once a user navigates to a dashboard
+DEFERRED_MODULES = [
+    'patient_dashboard',
+    'doctor_dashboard',
+    'streamlit_option_menu',
+    'fpdf',
+    'sklearn',
+    'joblib',
+    'inference_pipeline',
+    'report_service',
+]
+
+_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$')
+
+
+def import_times(module, repeat=3):
+    # Returns [(name, self_us, cumulative_us, depth)] from the fastest of `repeat` cold imports
+    working_dir = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ, DISEASE_PREDICTION_DATA_DIR=data_dir)
+        for _ in range(repeat):
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                                    cwd=working_dir, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+            entries = []
+            for line in result.stderr.splitlines():
+                match = _LINE.match(line)
+                if match:
+                    self_us, cumulative_us, indent, name = match.groups()
+                    entries.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+            total = sum(entry[1] for entry in entries)
+            if best is None or total < best[0]:
+                best = (total, entries)
+    return best[1]
+
+
+def profile(module, top=15, repeat=3):
+    entries = import_times(module, repeat)
+    imported = {name for name, _, _, _ in entries}
+    by_cumulative = sorted((e for e in entries if e[3] <= 1), key=lambda e: e[2], reverse=True)
+    by_self = sorted(entries, key=lambda e: e[1], reverse=True)
+    return {
+        'module': module,
+        'total_ms': sum(e[1] for e in entries) / 1000,
+        'modules_imported': len(entries),
+        'slowest_cumulative': [{'module': e[0], 'ms': e[2] / 1000} for e in by_cumulative[:top]],
+        'slowest_self': [{'module': e[0], 'ms': e[1] / 1000} for e in by_self[:top]],
+        'deferred_imported': [name for name in DEFERRED_MODULES if name in imported],
+    }
+
+
+def print_report(report):
+    print(f"{report['module']}: {report['total_ms']:.1f} ms, {report['modules_imported']} modules")
+    print("  slowest imports (including their dependencies):")
+    for entry in report['slowest_cumulative']:
+        print(f"    {entry['ms']:8.1f} ms  {entry['module']}")
+    print("  slowest modules (own time only):")
+    for entry in report['slowest_self']:
+        print(f"    {entry['ms']:8.1f} ms  {entry['module']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile import time of the app's entry points.")
+    parser.add_argument('modules', nargs='*', default=['login'])
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--repeat', type=int, default=3, help="Cold imports per module; the fastest is reported")
+    parser.add_argument('--budget-ms', type=float, default=STARTUP_BUDGET_MS,
+                        help="Maximum cold import time of the login page")
+    parser.add_argument('--json', action='store_true', help="Print the reports as JSON")
+    args = parser.parse_args(argv)
+
+    reports = [profile(module, args.top, args.repeat) for module in args.modules]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            print_report(report)
+
+    failed = False
+    for report in reports:
+        if report['module'] != 'login':
+            continue
+        if report['total_ms'] > args.budget_ms:
+            print(f"login imports in {report['total_ms']:.1f} ms, over the {args.budget_ms:.0f} ms budget",
+                  file=sys.stderr)
+            failed = True
+        if report['deferred_imported']:
+            print(f"login imports modules that should load on first navigation: "
+                  f"{', '.join(report['deferred_imported'])}", file=sys.stderr)
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,251 @@
+"""Streaming trainer for the disease models.
+
+Reproducible replacement for the training cells in Heart.ipynb and
+diabetes_.ipynb that also covers Parkinson's. Each dataset is read in
+chunks, so files larger than memory are fine:
+
+  1. One pass collects feature means and variances, with
+     StandardScaler.partial_fit, on the training rows.
+  2. `--epochs` passes fit an SGDClassifier with partial_fit. The default
+     log_loss is logistic regression and hinge is a linear SVM.
+  3. One pass scores the held-out rows for metrics.
+
+A fixed, seeded subset of every chunk is held out for evaluation. The scaler
+is then folded into the model's coefficients, so the published .sav scores
+raw dashboard inputs exactly like the existing models do. Hinge models get a
+Platt calibration fitted on the held-out scores.
+
+The diseases train in parallel, one process each. Every run writes a
+versioned copy of each model and its metrics to saved_models/versions/. The
+live saved_models/<model>.sav and <model>_pipeline.joblib are then replaced
+atomically (skip this with --dry-run):
+
+    python train.py diabetes=diabetes.csv heart=heart_disease_data.csv parkinsons=parkinsons.csv
+    python train.py heart=heart_disease_data.csv --epochs 20 --loss hinge --dry-run
+
+Files use the training datasets' column names and label columns (see
+diseases.py).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from diseases import DISEASES
+from feature_schema import to_array
+from model_registry import model_path, models_dir
+
+versions_dir = f"{models_dir}/versions"
+
+CLASSES = np.array([0, 1])
+
+
+def held_out(chunk_index, n_rows, test_fraction, seed):
+    # The same rows of a chunk are held out on every pass over the file
+    rng = np.random.default_rng([seed, chunk_index])
+    return rng.random(n_rows) < test_fraction
+
+
+def labelled_chunks(key, path, chunksize):
+    # (features, 0/1 labels) per chunk, features in the model's column order
+    from batch_predict import read_chunks
+
+    label = DISEASES[key]['label']
+    for chunk in read_chunks(path, chunksize):
+        if label not in chunk.columns:
+            raise ValueError(f"{path} has no '{label}' label column")
+        y = chunk[label].to_numpy(dtype=np.int64)
+        if not np.isin(y, CLASSES).all():
+            raise ValueError(f"Column '{label}' in {path} must only contain 0 and 1")
+        yield to_array(key, chunk), y
+
+
+def evaluate(decision, y):
+    predicted = decision > 0
+    positive = y == 1
+    tp = int(np.sum(predicted & positive))
+    fp = int(np.sum(predicted & ~positive))
+    fn = int(np.sum(~predicted & positive))
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    metrics = {
+        'test_rows': int(len(y)),
+        'accuracy': float(np.mean(predicted == positive)) if len(y) else None,
+        'precision': precision,
+        'recall': recall,
+        'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+        'roc_auc': None,
+    }
+    if 0 < positive.sum() < len(y):
+        from sklearn.metrics import roc_auc_score
+        metrics['roc_auc'] = float(roc_auc_score(positive, decision))
+    return metrics
+
+
+def train_model(key, path, chunksize=10000, epochs=5, loss='log_loss', alpha=1e-4, test_fraction=0.2, seed=0):
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.preprocessing import StandardScaler
+
+    from inference_pipeline import fit_calibration
+
+    start = time.perf_counter()
+    scaler = StandardScaler()
+    rows = train_rows = 0
+    for i, (X, y) in enumerate(labelled_chunks(key, path, chunksize)):
+        train = ~held_out(i, len(y), test_fraction, seed)
+        if train.any():
+            scaler.partial_fit(X[train])
+        rows += len(y)
+        train_rows += int(train.sum())
+    if train_rows == 0:
+        raise ValueError(f"{path} has no training rows")
+    scan_seconds = time.perf_counter() - start
+
+    model = SGDClassifier(loss=loss, alpha=alpha, random_state=seed)
+    rng = np.random.default_rng(seed)
+    epoch_seconds = []
+    for _ in range(epochs):
+        epoch_start = time.perf_counter()
+        for i, (X, y) in enumerate(labelled_chunks(key, path, chunksize)):
+            # Shuffle within the chunk; SGD converges badly on sorted data
+            order = rng.permutation(np.flatnonzero(~held_out(i, len(y), test_fraction, seed)))
+            if len(order):
+                model.partial_fit(scaler.transform(X[order]), y[order], classes=CLASSES)
+        epoch_seconds.append(time.perf_counter() - epoch_start)
+
+    eval_start = time.perf_counter()
+    decisions, labels = [], []
+    for i, (X, y) in enumerate(labelled_chunks(key, path, chunksize)):
+        test = held_out(i, len(y), test_fraction, seed)
+        if test.any():
+            decisions.append(model.decision_function(scaler.transform(X[test])))
+            labels.append(y[test])
+    decision = np.concatenate(decisions) if decisions else np.empty(0)
+    y_test = np.concatenate(labels) if labels else np.empty(0, dtype=np.int64)
+    metrics = evaluate(decision, y_test)
+    eval_seconds = time.perf_counter() - eval_start
+
+    # Fold the scaler into the coefficients so the model takes raw features
+    model.coef_ = model.coef_ / scaler.scale_
+    model.intercept_ = model.intercept_ - model.coef_ @ scaler.mean_
+
+    calibration = None
+    if not hasattr(model, 'predict_proba') and 0 < y_test.sum() < len(y_test):
+        calibration = fit_calibration(decision, y_test == 1)
+
+    total_seconds = time.perf_counter() - start
+    return {
+        'disease': key,
+        'model': model,
+        'calibration': calibration,
+        'metrics': metrics,
+        'rows': rows,
+        'train_rows': train_rows,
+        'timing': {
+            'scan_seconds': scan_seconds,
+            'epoch_seconds': epoch_seconds,
+            'eval_seconds': eval_seconds,
+            'total_seconds': total_seconds,
+            'rows_per_second': rows * (epochs + 2) / total_seconds,
+        },
+        'params': {'data': os.path.abspath(path), 'chunksize': chunksize, 'epochs': epochs, 'loss': loss,
+                   'alpha': alpha, 'test_fraction': test_fraction, 'seed': seed},
+    }
+
+
+def _atomic_write(path, write):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def publish(result, dry_run=False):
+    # Saves the versioned copy and metrics, then (unless dry_run) replaces the live model
+    import sklearn
+
+    from inference_pipeline import build_pipeline, save_pipeline
+
+    key = result['disease']
+    if not dry_run and not result['metrics']['test_rows']:
+        raise ValueError("no rows were held out for evaluation, so the model is not published "
+                         "(use more data or a larger --test-fraction)")
+    model = result['model']
+    artifact = build_pipeline(key, model=model, calibration=result['calibration'])
+    version = artifact['version']
+
+    os.makedirs(versions_dir, exist_ok=True)
+    _atomic_write(f"{versions_dir}/{key}-{version}.sav", lambda f: pickle.dump(model, f))
+    record = {key: value for key, value in result.items() if key != 'model'}
+    record.update(version=version, sklearn=sklearn.__version__, published=not dry_run,
+                  created_at=time.strftime('%Y-%m-%dT%H:%M:%S%z'))
+    _atomic_write(f"{versions_dir}/{key}-{version}.json", lambda f: f.write(json.dumps(record, indent=2).encode()))
+
+    if not dry_run:
+        # The .sav goes first: until the pipeline is replaced too, get_pipeline() ignores
+        # the older pipeline file and builds from the new model
+        _atomic_write(model_path(key), lambda f: pickle.dump(model, f))
+        save_pipeline(artifact)
+    return version
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the disease models from CSV or Parquet files.")
+    parser.add_argument('datasets', nargs='+', metavar='MODEL=PATH',
+                        help=f"Training data per model, e.g. heart=heart_disease_data.csv ({', '.join(DISEASES)})")
+    parser.add_argument('--chunksize', type=int, default=10000)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--loss', choices=['log_loss', 'hinge'], default='log_loss',
+                        help="log_loss trains logistic regression, hinge a linear SVM")
+    parser.add_argument('--alpha', type=float, default=1e-4, help="L2 regularization strength")
+    parser.add_argument('--test-fraction', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, help="Training processes (default: one per model)")
+    parser.add_argument('--dry-run', action='store_true', help="Record the new versions without publishing them")
+    args = parser.parse_args(argv)
+
+    jobs = {}
+    for dataset in args.datasets:
+        key, sep, path = dataset.partition('=')
+        if not sep or key not in DISEASES:
+            parser.error(f"Expected MODEL=PATH with MODEL one of {', '.join(DISEASES)}, got '{dataset}'")
+        jobs[key] = path
+    if not 0 < args.test_fraction < 1:
+        parser.error("--test-fraction must be between 0 and 1")
+
+    options = dict(chunksize=args.chunksize, epochs=args.epochs, loss=args.loss, alpha=args.alpha,
+                   test_fraction=args.test_fraction, seed=args.seed)
+    workers = args.workers or len(jobs)
+    failed = False
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {key: pool.submit(train_model, key, path, **options) for key, path in jobs.items()}
+        for key, future in futures.items():
+            try:
+                result = future.result()
+            except (OSError, ValueError) as e:
+                print(f"{key}: training failed: {e}", file=sys.stderr)
+                failed = True
+                continue
+            try:
+                version = publish(result, args.dry_run)
+            except ValueError as e:
+                print(f"{key}: {e}", file=sys.stderr)
+                failed = True
+                continue
+            metrics, timing = result['metrics'], result['timing']
+            accuracy, auc = (f"{metrics[name]:.3f}" if metrics[name] is not None else "n/a"
+                             for name in ('accuracy', 'roc_auc'))
+            print(f"{key}: version {version} {'recorded' if args.dry_run else 'published'}, "
+                  f"{result['train_rows']} training rows, accuracy {accuracy}, AUC {auc}, "
+                  f"{timing['total_seconds']:.1f}s ({timing['rows_per_second']:,.0f} rows/sec)")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())